@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers import asgi
+from django.core.signals import request_started
+from django.http import FileResponse
+from django.urls import set_script_prefix
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    # Тело запроса принимается и ответ отправляется в цикле событий, поэтому медленный мобильный клиент
+    # не занимает поток, пока передает фотографию или принимает выгрузку. Поток берется из пула только
+    # на время работы представления (ORM и DRF синхронные) и для потокового ответа - на время чтения
+    # из курсора. У каждого запроса все синхронные вызовы идут в одном потоке: соединение с БД
+    # в Django привязано к потоку, и request_finished закрывает именно его.
+    # Стандартный обработчик Django 3.0 выполняет все представления в одном общем потоке, а потоковые
+    # ответы читает прямо в цикле событий
+    def __init__(self):
+        super().__init__()
+        self.workers = None
+
+    async def checkout(self):
+        if self.workers is None:
+            self.workers = asyncio.Queue()
+            for _ in range(settings.ASGI_THREADS):
+                self.workers.put_nowait(ThreadPoolExecutor(max_workers=1, thread_name_prefix='asgi'))
+        return await self.workers.get()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError('Django can only handle ASGI/HTTP connections, not %s.' % scope['type'])
+        try:
+            body_file = await self.read_body(receive)
+        except asgi.RequestAborted:
+            return
+
+        loop = asyncio.get_running_loop()
+        worker = await self.checkout()
+        try:
+            response = await loop.run_in_executor(worker, self.handle, scope, body_file)
+            if response.streaming:
+                await self.send_start(response, send)
+                iterator = iter(response)
+                try:
+                    while True:
+                        part = await loop.run_in_executor(worker, next, iterator, None)
+                        if part is None:
+                            break
+                        for chunk, _ in self.chunk_bytes(part):
+                            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    await send({'type': 'http.response.body'})
+                finally:
+                    await loop.run_in_executor(worker, response.close)
+                return
+            await loop.run_in_executor(worker, response.close)
+        finally:
+            self.workers.put_nowait(worker)
+
+        # обычный ответ уже целиком в памяти: поток освобожден до отправки
+        await self.send_start(response, send)
+        for chunk, last in self.chunk_bytes(response.content):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': not last})
+
+    def handle(self, scope, body_file):
+        # префикс для reverse() хранится в asgiref Local потока: задается в потоке пула, где работает
+        # представление, а не в цикле событий
+        set_script_prefix(self.get_script_prefix(scope))
+        request_started.send(sender=self.__class__, scope=scope)
+        request, error_response = self.create_request(scope, body_file)
+        if request is None:
+            return error_response
+        response = self.get_response(request)
+        response._handler_class = self.__class__
+        if isinstance(response, FileResponse):
+            response.block_size = self.chunk_size
+        return response
+
+    async def send_start(self, response, send):
+        headers = []
+        for header, value in response.items():
+            headers.append((header.encode('ascii'), value.encode('latin1')))
+        for c in response.cookies.values():
+            headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
@@ -0,0 +1,97 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import UserProfile
+
+
+class TokenCache:
+    # ограниченный LRU-кэш токен -> (пользователь с профилем, токен) со временем жизни записей.
+    # Кэш живет в памяти процесса: сигналы сбрасывают записи только в том процессе, где произошло
+    # изменение, в остальных устаревшая запись живет не дольше TOKEN_CACHE_TTL.
+    # Запросы получают копии: представление может менять request.user, а запросы с одним токеном
+    # выполняются параллельно в разных потоках
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + settings.TOKEN_CACHE_TTL, copy.deepcopy(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None, user_id=None):
+        with self.lock:
+            if key is not None:
+                self.entries.pop(key, None)
+            if user_id is not None:
+                for k in [k for k, (_, (user, _)) in self.entries.items() if user.pk == user_id]:
+                    del self.entries[k]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # пользователь и его профиль достаются одним запросом и кэшируются, поэтому повторные запросы
+    # с тем же токеном не ходят в базу ни за токеном, ни за request.user.userprofile
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            token = Token.objects.select_related('user__userprofile').get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        token_cache.set(key, (token.user, token))
+        return token.user, token
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate(key=instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user(sender, instance, **kwargs):
+    token_cache.invalidate(user_id=instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile(sender, instance, **kwargs):
+    token_cache.invalidate(user_id=instance.user_id)
@@ -0,0 +1,267 @@
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import (ChecklistAnswer, ChecklistQuestion, Client, ClientVisibility, DataVersion, Price, Product,
+                     UserProfile, Visit)
+
+# SQLite ограничивает количество параметров в одном запросе, поэтому списки для IN (...)
+# и массовые операции режем на пачки
+BATCH_SIZE = 500
+
+# ключ в данных от 1С -> поле модели Client
+CLIENT_FIELDS = {
+    'name': 'name',
+    'clientType': 'client_type',
+    'priceType': 'price_type',
+    'delay': 'delay',
+    'limit': 'limit',
+    'address': 'address',
+    'longitude': 'longitude',
+    'latitude': 'latitude',
+    'email': 'email',
+    'phone': 'phone',
+    'status': 'status',
+    'dataBase': 'database',
+}
+
+PRODUCT_FIELDS = ['name', 'description', 'active']
+
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def resolve_managers(manager_ids):
+    # manager_ID из 1С -> id пользователя, одним запросом на пачку
+    result = {}
+    for batch in chunks(set(manager_ids)):
+        result.update(UserProfile.objects.filter(manager_ID__in=batch).values_list('manager_ID', 'user_id'))
+    return result
+
+
+def upsert_clients(data):
+    # повторы ИНН в одной выгрузке сливаем, более поздние значения побеждают, как при построчной обработке
+    merged = {}
+    for c in data:
+        merged.setdefault(c['inn'], {}).update(c)
+
+    wanted = set()
+    for c in merged.values():
+        if 'manager' in c:
+            wanted.add(c['manager'])
+        wanted.update(c.get('authorizedManagersID', []))
+    managers = resolve_managers(wanted)
+    unknown = sorted({c['manager'] for c in merged.values() if 'manager' in c} - managers.keys())
+    if unknown:
+        raise User.DoesNotExist("Can't find manager with such ID: " + ', '.join(unknown))
+
+    existing = {}
+    for batch in chunks(merged):
+        existing.update((c.INN, c) for c in Client.objects.filter(INN__in=batch))
+
+    through = Client.authorized_managers.through
+    current = defaultdict(dict)  # client_id -> {user_id: id строки связи}
+    for batch in chunks(c.pk for c in existing.values()):
+        for pk, client_id, user_id in through.objects.filter(client_id__in=batch).values_list(
+                'id', 'client_id', 'user_id'):
+            current[client_id][user_id] = pk
+
+    now = timezone.now()
+    to_create, to_update, unchanged = [], [], 0
+    links_to_add, links_to_remove = [], []
+    new_links = {}  # ИНН нового клиента -> множество id менеджеров
+    for inn, c in merged.items():
+        client = existing.get(inn)
+        if client is None:
+            client = Client(INN=inn, name=c.get('name', ''))
+            to_create.append(client)
+
+        changed = False
+        for key, field in CLIENT_FIELDS.items():
+            if key in c and getattr(client, field) != c[key]:
+                setattr(client, field, c[key])
+                changed = True
+        if 'manager' in c and client.manager_id != managers[c['manager']]:
+            client.manager_id = managers[c['manager']]
+            changed = True
+
+        if 'authorizedManagersID' in c:
+            authorized = {managers[m] for m in c['authorizedManagersID'] if m in managers}
+            if client.pk is None:
+                new_links[inn] = authorized
+            else:
+                linked = current[client.pk]
+                added = authorized - linked.keys()
+                removed = linked.keys() - authorized
+                links_to_add.extend(through(client_id=client.pk, user_id=user_id) for user_id in added)
+                links_to_remove.extend(linked[user_id] for user_id in removed)
+                changed = changed or bool(added or removed)
+
+        if client.pk is not None:
+            if changed:
+                client.last_modified = now
+                to_update.append(client)
+            else:
+                unchanged += 1
+
+    with transaction.atomic():
+        Client.objects.bulk_create(to_create)
+        Client.objects.bulk_update(
+            to_update, list(CLIENT_FIELDS.values()) + ['manager', 'last_modified'], batch_size=BATCH_SIZE)
+
+        # SQLite не возвращает первичные ключи после bulk_create, дочитываем их по ИНН
+        touched = [c.pk for c in to_update]
+        for batch in chunks(c.INN for c in to_create):
+            for inn, pk in Client.objects.filter(INN__in=batch).values_list('INN', 'id'):
+                touched.append(pk)
+                links_to_add.extend(through(client_id=pk, user_id=user_id) for user_id in new_links.get(inn, ()))
+
+        for batch in chunks(links_to_remove):
+            through.objects.filter(id__in=batch).delete()
+        through.objects.bulk_create(links_to_add)
+        if touched:
+            ClientVisibility.refresh(touched)
+            DataVersion.bump('client')
+
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'unchanged': unchanged,
+    }
+
+
+def upsert_checklist_answers(data):
+    # повторная отправка ответа на тот же вопрос в том же визите обновляет ответ (unique_together),
+    # а не роняет весь запрос
+    merged = {}
+    for a in data:
+        try:
+            question_uuid = uuid.UUID(a['questionUUID'])
+        except ValueError:
+            raise ChecklistQuestion.DoesNotExist('Something wrong with question UUID')
+        merged[(a['visitUUID'], question_uuid)] = a
+
+    visits = {}
+    for batch in chunks({v for v, _ in merged}):
+        visits.update(Visit.objects.filter(UUID__in=batch).values_list('UUID', 'id'))
+    questions = set()
+    for batch in chunks({q for _, q in merged}):
+        questions.update(ChecklistQuestion.objects.filter(UUID__in=batch).values_list('UUID', flat=True))
+    if any(v not in visits for v, _ in merged):
+        raise Visit.DoesNotExist('Something wrong with visit UUID')
+    if any(q not in questions for _, q in merged):
+        raise ChecklistQuestion.DoesNotExist('Something wrong with question UUID')
+
+    try:
+        return _write_checklist_answers(merged, visits)
+    except IntegrityError:
+        # параллельный запрос успел вставить те же ответы: теперь это обновления
+        return _write_checklist_answers(merged, visits)
+
+
+def _write_checklist_answers(merged, visits):
+    with transaction.atomic():
+        existing = {}
+        next_order = defaultdict(int)
+        for batch in chunks(set(visits.values())):
+            for a in ChecklistAnswer.objects.filter(visit_id__in=batch):
+                existing[(a.visit_id, a.question_id)] = a
+                next_order[a.visit_id] = max(next_order[a.visit_id], a._order + 1)
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for (visit_uuid, question_id), a in merged.items():
+            visit_id = visits[visit_uuid]
+            answer1, answer2 = str(a.get('answer1', '')), a.get('answer2', '')
+            answer = existing.get((visit_id, question_id))
+            if answer is None:
+                # bulk_create не заполняет _order для order_with_respect_to, считаем сами как Model.save()
+                to_create.append(ChecklistAnswer(
+                    visit_id=visit_id, question_id=question_id, answer1=answer1, answer2=answer2,
+                    _order=next_order[visit_id]))
+                next_order[visit_id] += 1
+            elif (answer.answer1, answer.answer2) != (answer1, answer2):
+                answer.answer1, answer.answer2, answer.last_modified = answer1, answer2, now
+                to_update.append(answer)
+
+        ChecklistAnswer.objects.bulk_create(to_create)
+        ChecklistAnswer.objects.bulk_update(to_update, ['answer1', 'answer2', 'last_modified'], batch_size=BATCH_SIZE)
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'unchanged': len(merged) - len(to_create) - len(to_update),
+    }
+
+
+def upsert_prices(data):
+    # прайс из 1С - это товары x типы цен, ключ строки - (артикул, тип цен, БД)
+    merged = {}
+    for p in data:
+        merged[(p['productItem'], p['priceType'], p['dataBase'])] = str(p['amount'])
+
+    existing = {}
+    for batch in chunks({item for item, _, _ in merged}):
+        for price in Price.objects.filter(product_item__in=batch):
+            existing[(price.product_item, price.price_type, price.database)] = price
+
+    to_create, to_update = [], []
+    for (item, price_type, database), amount in merged.items():
+        price = existing.get((item, price_type, database))
+        if price is None:
+            to_create.append(Price(product_item=item, price_type=price_type, database=database, amount=amount))
+        elif price.amount != amount:
+            price.amount = amount
+            to_update.append(price)
+
+    with transaction.atomic():
+        Price.objects.bulk_create(to_create)
+        Price.objects.bulk_update(to_update, ['amount'], batch_size=BATCH_SIZE)
+        if to_create or to_update:
+            DataVersion.bump('price')
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'unchanged': len(merged) - len(to_create) - len(to_update),
+    }
+
+
+def upsert_products(data):
+    merged = {}
+    for p in data:
+        merged.setdefault(p['item'], {}).update(p)
+
+    existing = {}
+    for batch in chunks(merged):
+        existing.update((p.item, p) for p in Product.objects.filter(item__in=batch))
+
+    to_create, to_update, changed_fields = [], [], set()
+    for item, p in merged.items():
+        product = existing.get(item)
+        if product is None:
+            to_create.append(Product(item=item, **{f: p[f] for f in PRODUCT_FIELDS if f in p}))
+            continue
+        changed = [f for f in PRODUCT_FIELDS if f in p and getattr(product, f) != p[f]]
+        if changed:
+            for f in changed:
+                setattr(product, f, p[f])
+            to_update.append(product)
+            changed_fields.update(changed)
+
+    with transaction.atomic():
+        Product.objects.bulk_create(to_create)
+        # пишем только изменившиеся строки и только те поля, что менялись хотя бы в одной из них
+        if to_update:
+            Product.objects.bulk_update(to_update, sorted(changed_fields), batch_size=BATCH_SIZE)
+        if to_create or to_update:
+            DataVersion.bump('product')
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'unchanged': len(merged) - len(to_create) - len(to_update),
+    }
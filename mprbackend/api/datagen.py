@@ -0,0 +1,232 @@
+import random
+import uuid
+import zlib
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .bulk import chunks
+from .models import (ChecklistAnswer, ChecklistQuestion, Client, ClientVisibility, DataVersion, Order, Price,
+                     Product, UserProfile, Visit)
+
+CLIENT_TYPES = ['Аптека', 'Сеть', 'Дистрибьютор', 'Магазин']
+PRICE_TYPES = ['1', '2', '3']
+# ИНН клиента - 9, три цифры от префикса и восьмизначный номер (DataGenerator.clients)
+MAX_CLIENTS = 10 ** 8
+
+VISIT_COLUMNS = ['UUID', 'manager_id', 'author_id', 'client_INN', 'date', 'status', 'payment_plan', 'payment',
+                 'delivery_date']
+ORDER_COLUMNS = ['visit_id', 'product_item', 'order', 'recommend', 'balance', 'sales']
+ANSWER_COLUMNS = ['visit_id', 'UUID', 'question_id', 'answer1', '_order']
+
+# значения этих типов драйвер БД принимает как есть, остальные готовит поле модели
+RAW_TYPES = {'AutoField', 'BigAutoField', 'BooleanField', 'CharField', 'FloatField', 'IntegerField',
+             'BigIntegerField', 'SmallIntegerField', 'TextField'}
+
+
+def insert_rows(model, columns, rows):
+    # bulk_create тратит больше времени на экземпляры моделей и подготовку каждого значения, чем база -
+    # на запись: для миллионов строк пишем кортежи через executemany. Остальные поля получают значения
+    # по умолчанию, created и last_modified - текущее время, как при обычном сохранении
+    if not rows:
+        return
+    meta = model._meta
+    fields = [meta.get_field(name) for name in columns]
+    now = timezone.now()
+    constants, constant_fields = [], []
+    for field in meta.concrete_fields:
+        if field in fields or field.primary_key and field.get_internal_type() in ('AutoField', 'BigAutoField'):
+            continue
+        value = now if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False) \
+            else field.get_default()
+        constant_fields.append(field)
+        constants.append(field.get_db_prep_save(value, connection))
+    prepare = [(i, field.get_db_prep_save) for i, field in enumerate(fields)
+               if (field.target_field if field.is_relation else field).get_internal_type() not in RAW_TYPES]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields + constant_fields),
+        ', '.join(['%s'] * (len(fields) + len(constant_fields))))
+    constants = tuple(constants)
+    values = []
+    for row in rows:
+        if prepare:
+            row = list(row)
+            for i, prep in prepare:
+                row[i] = prep(row[i], connection)
+            row = tuple(row)
+        values.append(row + constants)
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, values)
+
+
+class DataGenerator:
+    # синтетические данные для нагрузочных проверок и стендов: менеджеры, клиенты с авторизованными
+    # менеджерами, товары, цены, вопросы чек-листа, визиты со строками заказа и ответами.
+    # Все пишется массовыми вставками пачками по batch_size, каждая пачка - своя транзакция.
+    # При одном и том же seed и today данные совпадают, повторный запуск не создает дублей
+    def __init__(self, seed=0, batch_size=5000, today=None, prefix='gen', log=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.today = today or timezone.now().date()
+        self.prefix = prefix
+        self.log = log or (lambda message: None)
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def managers(self, count):
+        usernames = ['%s-mpr-%d' % (self.prefix, i) for i in range(count)]
+        users = []
+        for name in usernames:
+            user = User(username=name, first_name='Менеджер', last_name=name)
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        # bulk_create не вызывает сигнал, который создает профиль
+        UserProfile.objects.bulk_create([UserProfile(user_id=ids[name], role='MPR', manager_ID=name)
+                                         for name in usernames], ignore_conflicts=True)
+        DataVersion.bump('userprofile')
+        return [ids[name] for name in usernames]
+
+    def products(self, count):
+        items = ['%s-%05d' % (self.prefix, i) for i in range(count)]
+        Product.objects.bulk_create([Product(item=item, name='Товар ' + item, active=self.rng.random() > 0.05)
+                                     for item in items], ignore_conflicts=True)
+        Price.objects.bulk_create([
+            Price(product_item=item, price_type=price_type, database=database,
+                  amount=str(self.rng.randint(50, 5000)))
+            for item in items for price_type in PRICE_TYPES for database in (True, False)
+        ], ignore_conflicts=True)
+        DataVersion.bump('product', 'price')
+        return items
+
+    def questions(self, count):
+        questions = [ChecklistQuestion(UUID=self.uuid(), client_type=self.rng.choice(CLIENT_TYPES),
+                                       text='Вопрос %d' % i, section='Раздел %d' % (i % 5)) for i in range(count)]
+        ChecklistQuestion.objects.bulk_create(questions, ignore_conflicts=True)
+        DataVersion.bump('checklistquestion')
+        return [q.UUID for q in questions]
+
+    def clients(self, count, managers, authorized=2):
+        # у каждого клиента основной менеджер и еще несколько авторизованных. ИНН - 12 цифр, префикс в него
+        # не помещается, поэтому каждому префиксу отведен свой блок номеров: 9, три цифры от префикса, номер
+        inns = ['9%03d%08d' % (zlib.crc32(self.prefix.encode()) % 1000, i) for i in range(count)]
+        main = {inn: self.rng.choice(managers) for inn in inns}
+        for part in chunks(inns, self.batch_size):
+            with transaction.atomic():
+                # уже созданные клиенты не пересоздаются: визиты пойдут от их настоящего менеджера. Клиент
+                # чужого менеджера значит, что блок номеров совпал с другим префиксом
+                existing = dict(Client.objects.filter(INN__in=part).values_list('INN', 'manager_id'))
+                taken = [inn for inn, manager_id in existing.items() if manager_id not in managers]
+                if taken:
+                    raise ValueError('Client INN %s is already used by another prefix or real data' % taken[0])
+                main.update(existing)
+                Client.objects.bulk_create([Client(
+                    INN=inn,
+                    name='Клиент ' + inn,
+                    client_type=self.rng.choice(CLIENT_TYPES),
+                    price_type=self.rng.choice(PRICE_TYPES),
+                    manager_id=main[inn],
+                ) for inn in part], ignore_conflicts=True)
+                ids = dict(Client.objects.filter(INN__in=part).values_list('INN', 'id'))
+                through = Client.authorized_managers.through
+                through.objects.bulk_create([
+                    through(client_id=ids[inn], user_id=user_id) for inn in part
+                    for user_id in self.rng.sample(managers, min(authorized, len(managers)))
+                ], ignore_conflicts=True)
+                ClientVisibility.refresh(ids.values())
+        DataVersion.bump('client')
+        return main
+
+    def visits(self, count, clients, items, questions, orders=5, answers=3, days_back=365, days_ahead=14):
+        # прошедшие визиты завершены, с оплатой, заказом и ответами; сегодняшние и будущие - запланированы
+        by_manager = {}
+        for inn, manager in clients.items():
+            by_manager.setdefault(manager, []).append(inn)
+        managers = sorted(by_manager)
+        created = {'visits': 0, 'orders': 0, 'answers': 0}
+        for start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - start)
+            # строки заказа и ответы генерируются и для уже существующих визитов: иначе при повторном
+            # запуске последовательность случайных чисел сдвинется и UUID следующих пачек совпадут со старыми
+            generated = []
+            for _ in range(size):
+                manager = self.rng.choice(managers)
+                days = self.rng.randint(-days_back, days_ahead)
+                generated.append(self.visit(manager, manager, self.rng.choice(by_manager[manager]),
+                                            days, items, questions, orders, answers))
+            result = self.save_visits(generated)
+            for key, value in result.items():
+                created[key] += value
+            self.log('%d/%d visits' % (start + size, count))
+        return created
+
+    def visit(self, manager, author, inn, days, items, questions, orders, answers):
+        # визит - строка для VISIT_COLUMNS, заказ и ответы - строки без визита для ORDER_COLUMNS и ANSWER_COLUMNS
+        visit_uuid = self.uuid()
+        date = self.today + timezone.timedelta(days=days)
+        payment_plan = self.rng.randint(2000, 10000)
+        if days >= 0:
+            return (visit_uuid, manager, author, inn, date, 0, payment_plan, None, None), [], []
+        payment = payment_plan - self.rng.randint(-1000, 2000)
+        delivery_date = date + timezone.timedelta(days=self.rng.randint(6, 14))
+        rows, lines = [], []
+        for item in self.rng.sample(items, min(orders, len(items))):
+            order = self.rng.randint(1, 15)
+            rows.append((item, order, max(order - self.rng.randint(0, 2), 0), self.rng.randint(0, 10),
+                         self.rng.randint(0, 15)))
+        # order_with_respect_to: позиция ответа в визите пишется явно
+        for position, question in enumerate(self.rng.sample(questions, min(answers, len(questions)))):
+            lines.append((uuid.UUID(self.uuid()), question, self.rng.choice(['Да', 'Нет']), position))
+        return (visit_uuid, manager, author, inn, date, 2, payment_plan, payment, delivery_date), rows, lines
+
+    def manager_visits(self, manager, author, inns, items):
+        # демонстрационный набор одного менеджера (resetvisits): визиты на сегодня и следующие четыре дня
+        # к случайным клиентам и по три завершенных визита к каждому клиенту с заказом всех товаров
+        planned = [(self.rng.choice(inns), 0) for _ in range(self.rng.randint(4, 8))]
+        planned += [(self.rng.choice(inns), days) for _ in range(self.rng.randint(10, 16)) for days in range(1, 5)]
+        planned += [(inn, -(14 * (delta + 1) + self.rng.randint(0, 5))) for inn in inns for delta in range(3)]
+        return self.save_visits([self.visit(manager, author, inn, days, items, [], len(items), 0)
+                                 for inn, days in planned])
+
+    def save_visits(self, generated):
+        with transaction.atomic():
+            existing = set()
+            for part in chunks([v[0] for v, _, _ in generated]):
+                existing.update(Visit.objects.filter(UUID__in=part).values_list('UUID', flat=True))
+            generated = [g for g in generated if g[0][0] not in existing]
+            insert_rows(Visit, VISIT_COLUMNS, [v for v, _, _ in generated])
+            ids = {}
+            for part in chunks([v[0] for v, _, _ in generated]):
+                ids.update(Visit.objects.filter(UUID__in=part).values_list('UUID', 'id'))
+            rows, lines = [], []
+            for v, visit_rows, visit_lines in generated:
+                visit_id = ids[v[0]]
+                rows.extend((visit_id,) + row for row in visit_rows)
+                lines.extend((visit_id,) + line for line in visit_lines)
+            insert_rows(Order, ORDER_COLUMNS, rows)
+            insert_rows(ChecklistAnswer, ANSWER_COLUMNS, lines)
+        return {'visits': len(generated), 'orders': len(rows), 'answers': len(lines)}
+
+    def generate(self, managers=10, clients=1000, products=500, questions=20, visits=10000, orders=5, answers=3):
+        # у визита должен быть клиент, у клиента - менеджер
+        if visits > 0 and clients < 1:
+            raise ValueError('Visits need at least one client')
+        if clients > 0 and managers < 1:
+            raise ValueError('Clients need at least one manager')
+        if clients > MAX_CLIENTS:
+            raise ValueError('At most %d clients per prefix' % MAX_CLIENTS)
+        manager_ids = self.managers(managers)
+        self.log('%d managers' % len(manager_ids))
+        items = self.products(products)
+        self.log('%d products' % len(items))
+        question_ids = self.questions(questions)
+        client_managers = self.clients(clients, manager_ids)
+        self.log('%d clients' % len(client_managers))
+        result = self.visits(visits, client_managers, items, question_ids, orders, answers)
+        result.update({'managers': len(manager_ids), 'clients': len(client_managers), 'products': len(items),
+                       'questions': len(question_ids)})
+        return result
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    # постоянное соединение могло быть оборвано базой или сетью, пока простаивало между запросами:
+    # такое закрываем заранее, и запрос откроет новое вместо ошибки на первом же SQL
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for conn in connections.all():
+        if conn.connection is not None and conn.settings_dict['CONN_MAX_AGE'] and not conn.is_usable():
+            conn.close()
+
+
+def database_status():
+    # для GET /api/health: база отвечает и с какими параметрами открыто соединение
+    connection = connections['default']
+    result = {'engine': connection.vendor}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+        if connection.vendor == 'sqlite':
+            # busy_timeout задает OPTIONS['timeout'] базы, а не SQLITE_PRAGMAS
+            for name in [*settings.SQLITE_PRAGMAS, 'busy_timeout']:
+                cursor.execute('PRAGMA %s' % name)
+                row = cursor.fetchone()
+                result[name] = row[0] if row else None
+    return result
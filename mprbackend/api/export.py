@@ -0,0 +1,104 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Order, Visit
+
+# строк в одной пачке: столько читается из курсора за раз и столько попадает в один колоночный блок
+BATCH_SIZE = 2000
+
+# (колонка выгрузки, поле для values_list)
+VISIT_COLUMNS = [
+    ('id', 'id'),
+    ('UUID', 'UUID'),
+    ('date', 'date'),
+    ('deliveryDate', 'delivery_date'),
+    ('clientINN', 'client_INN'),
+    ('managerID', 'manager__userprofile__manager_ID'),
+    ('author', 'author__userprofile__manager_ID'),
+    ('status', 'status'),
+    ('dataBase', 'database'),
+    ('payment', 'payment'),
+    ('paymentPlan', 'payment_plan'),
+    ('processed', 'processed'),
+    ('invoice', 'invoice'),
+    ('lastModified', 'last_modified'),
+]
+
+ORDER_COLUMNS = [
+    ('visitID', 'visit_id'),
+    ('visitUUID', 'visit__UUID'),
+    ('productItem', 'product_item'),
+    ('order', 'order'),
+    ('delivered', 'delivered'),
+    ('recommend', 'recommend'),
+    ('balance', 'balance'),
+    ('sales', 'sales'),
+]
+
+TABLES = {
+    'visits': (Visit, VISIT_COLUMNS, 'date'),
+    'orders': (Order, ORDER_COLUMNS, 'visit__date'),
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'columns': 'application/x-ndjson',
+}
+
+
+def export_rows(table, date_from=None, date_to=None):
+    # кортежи значений прямо из курсора (на PostgreSQL - серверного), без создания объектов моделей
+    model, columns, date_field = TABLES[table]
+    q = model.objects.all()
+    if date_from:
+        q = q.filter(**{date_field + '__gte': date_from})
+    if date_to:
+        q = q.filter(**{date_field + '__lte': date_to})
+    return q.order_by('pk').values_list(*[field for _, field in columns]).iterator(chunk_size=BATCH_SIZE)
+
+
+class Echo:
+    # csv.writer пишет в "файл", который просто возвращает строку - она сразу уходит в поток ответа
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in columns])
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) == BATCH_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def column_batches(columns, rows):
+    # колоночные блоки по BATCH_SIZE строк, по одному JSON-объекту на строку потока:
+    # {"rows": N, "columns": {"UUID": [...], "date": [...], ...}}
+    encoder = DjangoJSONEncoder()
+    names = [name for name, _ in columns]
+
+    def encode(batch):
+        return encoder.encode({'rows': len(batch), 'columns': dict(zip(names, map(list, zip(*batch))))}) + '\n'
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield encode(batch)
+            batch = []
+    if batch:
+        yield encode(batch)
+
+
+def export(table, export_format='csv', date_from=None, date_to=None):
+    columns = TABLES[table][1]
+    rows = export_rows(table, date_from, date_to)
+    if export_format == 'columns':
+        return column_batches(columns, rows)
+    return csv_lines(columns, rows)
@@ -0,0 +1,107 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import BaseRenderer
+
+# файлы читаются блоками по 64 КБ вместо 4 КБ по умолчанию у FileResponse
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PassthroughRenderer(BaseRenderer):
+    # чтобы запрос с Accept: image/* не получил 406 при согласовании формата в DRF
+    media_type = '*/*'
+    format = None
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+def parse_range(header, size):
+    # один диапазон bytes=start-end, bytes=start- или bytes=-suffix. Несколько диапазонов
+    # не поддерживаются (None - отдать файл целиком), ValueError - диапазон вне файла
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def serve_file(request, field_file, cache=True):
+    # файл хранилища с поддержкой условных запросов и Range. Если настроен PHOTO_ACCEL_REDIRECT,
+    # сами байты отдает фронтовый nginx по внутреннему location, Django только проверяет доступ.
+    # cache=False - ответ временный (оригинал вместо еще не готового варианта): без ETag и Last-Modified,
+    # чтобы клиент не сохранил его под адресом варианта
+    path = field_file.path
+    stat = os.stat(path)
+    etag = quote_etag('%x-%x' % (int(stat.st_mtime), stat.st_size))
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime)) if cache else None
+    if response is None:
+        if settings.PHOTO_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.PHOTO_ACCEL_REDIRECT + quote(field_file.name)
+        else:
+            response = file_response(request, path, stat.st_size, etag if cache else None, content_type)
+    if not cache:
+        response['Cache-Control'] = 'no-cache'
+        return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    # оригиналы и варианты под своим именем не меняются, но доступны только авторизованным
+    response['Cache-Control'] = 'private, max-age=%d' % settings.PHOTO_CACHE_MAX_AGE
+    return response
+
+
+def file_response(request, path, size, etag, content_type):
+    header = request.META.get('HTTP_RANGE')
+    # If-Range: диапазон отдается, только если у клиента та же версия файла
+    if header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(read_range(open(path, 'rb'), start, end - start + 1),
+                                             status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            response['Content-Length'] = end - start + 1
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    # файл целиком: WSGI-сервер с wsgi.file_wrapper отдает его через sendfile
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response.block_size = BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,92 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Photo
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    # пул создается при первой фотографии, а не при импорте модуля (manage.py, миграции)
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PHOTO_WORKERS, thread_name_prefix='photos')
+        return _executor
+
+
+def encode_variant(image, size):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    # EXIF и прочие метаданные не передаются: сохраняются только пиксели
+    variant.save(buffer, 'JPEG', quality=settings.PHOTO_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+VARIANT_FIELDS = ['width', 'height', 'size', 'processed']
+
+
+def copy_variants(photo):
+    # у фотографии с тем же содержимым варианты уже готовы - ссылаемся на те же файлы
+    if photo.blob_id is None:
+        return False
+    done = Photo.objects.filter(blob_id=photo.blob_id, processed__isnull=False).exclude(pk=photo.pk).first()
+    if done is None:
+        return False
+    for field in VARIANT_FIELDS + list(settings.PHOTO_VARIANTS):
+        setattr(photo, field, getattr(done, field))
+    photo.save(update_fields=VARIANT_FIELDS + list(settings.PHOTO_VARIANTS))
+    return True
+
+
+def process_photo(photo_id):
+    # размеры оригинала и уменьшенные копии. Декодирование и масштабирование в Pillow отпускают GIL,
+    # поэтому потоки пула не мешают обработке запросов
+    photo = Photo.objects.select_related('visit').get(pk=photo_id)
+    if copy_variants(photo):
+        return
+    with Image.open(photo.image.path) as image:
+        photo.width, photo.height = image.size
+        # ориентация из EXIF 5-8 - снимок повернут на 90 градусов
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            photo.width, photo.height = photo.height, photo.width
+        # JPEG сразу декодируется в уменьшенном масштабе, достаточном для самого большого варианта
+        image.draft('RGB', max(settings.PHOTO_VARIANTS.values()))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        stem = os.path.splitext(os.path.basename(photo.image.name))[0]
+        for name, size in settings.PHOTO_VARIANTS.items():
+            getattr(photo, name).save('%s_%s.jpg' % (stem, name), ContentFile(encode_variant(image, size)),
+                                      save=False)
+    photo.size = photo.image.size
+    photo.processed = timezone.now()
+    photo.save(update_fields=VARIANT_FIELDS + list(settings.PHOTO_VARIANTS))
+
+
+def run(photo_id):
+    try:
+        process_photo(photo_id)
+    except Exception:
+        logger.exception('Photo %s processing failed', photo_id)
+    finally:
+        # соединение с БД принадлежит потоку пула, держать его открытым между задачами незачем
+        connections.close_all()
+
+
+def schedule(photo):
+    if copy_variants(photo):
+        return
+    # обработка начинается после коммита, иначе поток может не увидеть новую строку
+    transaction.on_commit(lambda: executor().submit(run, photo.pk))
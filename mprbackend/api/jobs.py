@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .bulk import chunks, upsert_clients, upsert_prices, upsert_products
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+IMPORTERS = {
+    'clients': upsert_clients,
+    'prices': upsert_prices,
+    'products': upsert_products,
+}
+
+# ошибки данных, которые импорт сообщает как есть; остальное - сбой, пишется в лог
+DATA_ERRORS = (User.DoesNotExist,)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMPORT_WORKERS, thread_name_prefix='imports')
+        return _executor
+
+
+def enqueue(kind, data, author):
+    # данные уже прошли проверку схемой. Задание сохраняется в базе и уходит в пул после коммита;
+    # если процесс перезапустится раньше, его подберет команда runimportjobs
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    digest = hashlib.sha256((kind + payload).encode()).hexdigest()
+    with transaction.atomic():
+        # только с заданиями в очереди: running могло остаться от упавшего процесса, и повтор выгрузки
+        # навсегда получал бы мертвое задание. Параллельный повторный импорт безвреден - upsert идемпотентен
+        job = ImportJob.objects.filter(kind=kind, digest=digest, status='queued').first()
+        if job is not None:
+            return job
+        job = ImportJob.objects.create(kind=kind, author=author, digest=digest, payload=payload, total=len(data))
+        if settings.IMPORT_WORKERS:
+            transaction.on_commit(lambda: executor().submit(run, job.pk))
+    return job
+
+
+def process_job(job_id):
+    # задание берет тот, кто первым переведет его из queued в running: пул процесса или команда
+    if not ImportJob.objects.filter(pk=job_id, status='queued').update(status='running', started=timezone.now()):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+    data = json.loads(job.payload)
+    totals = {'created': 0, 'updated': 0, 'unchanged': 0}
+    try:
+        # каждая пачка - своя короткая транзакция вместе с отметкой processed: большая выгрузка не держит
+        # блокировку записи все время импорта, а опрос задания показывает ход импорта
+        for part in chunks(data, settings.IMPORT_CHUNK_SIZE):
+            with transaction.atomic():
+                for key, value in IMPORTERS[job.kind](part).items():
+                    totals[key] += value
+                job.processed += len(part)
+                ImportJob.objects.filter(pk=job_id).update(processed=job.processed, result=json.dumps(totals))
+    except DATA_ERRORS as e:
+        fail(job_id, e)
+        return
+    ImportJob.objects.filter(pk=job_id).update(status='done', result=json.dumps(totals), finished=timezone.now())
+
+
+def fail(job_id, error):
+    # ошибка после примененных пачек - partial: processed строк уже в базе, остальные не применены
+    ImportJob.objects.filter(pk=job_id, processed=0).update(status='failed', error=str(error), finished=timezone.now())
+    ImportJob.objects.filter(pk=job_id, processed__gt=0).update(status='partial', error=str(error),
+                                                                finished=timezone.now())
+
+
+def run(job_id):
+    try:
+        process_job(job_id)
+    except Exception as e:
+        logger.exception('Import job %s failed', job_id)
+        fail(job_id, e)
+    finally:
+        connections.close_all()
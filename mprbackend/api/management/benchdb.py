@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def throwaway_database():
+    # нагрузочные команды засевают отдельную базу, как manage.py test, и удаляют ее по завершении:
+    # рабочие данные не затрагиваются. SQLite - во временном файле, а не в памяти, как рабочая база
+    setup_test_environment()
+    tmpdir = None
+    if connection.vendor == 'sqlite':
+        tmpdir = tempfile.mkdtemp(prefix='mprbench')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.datagen import DataGenerator
+from api.management.benchdb import throwaway_database
+from api.models import Client, Price, UserProfile, Visit
+from api.stats import refresh as refresh_stats
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'benchmarks', 'baseline.json')
+
+# абсолютный запас поверх относительного допуска: у маленьких ответов разброс больше любого процента
+NOISE = {'peak_kb': 64, 'p50_ms': 5}
+
+VOLUMES = ['managers', 'clients', 'products', 'questions', 'visits', 'orders', 'answers']
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка API: засевает тестовую базу синтетическими данными (api.datagen), '
+            'вызывает представления через тестовый клиент и выводит p50/p95 времени ответа, число SQL-запросов '
+            'и пик памяти на запрос для каждого эндпоинта. С сохраненным эталоном (--baseline) рост числа '
+            'запросов или памяти сверх --tolerance завершает команду с ошибкой; время ответа зависит от машины '
+            'и нагрузки на нее, поэтому проверяется только с --strict-latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--managers', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--products', type=int, default=300)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--visits', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=5, help='строк заказа на завершенный визит')
+        parser.add_argument('--answers', type=int, default=3, help='ответов чек-листа на завершенный визит')
+        parser.add_argument('--requests', type=int, default=20, help='замеров на эндпоинт')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='допустимый рост памяти и медианы времени относительно эталона (0.5 - на 50%%)')
+        parser.add_argument('--strict-latency', action='store_true',
+                            help='проверять и медиану времени ответа: эталон должен быть снят на той же машине')
+
+    def handle(self, *args, **options):
+        # замеры под tracemalloc заведомо медленные: предупреждения MetricsMiddleware о них только мешают
+        logging.getLogger('api.metrics').setLevel(logging.ERROR)
+        volumes = {name: options[name] for name in VOLUMES}
+        with throwaway_database():
+            started = time.perf_counter()
+            DataGenerator(seed=options['seed']).generate(**volumes)
+            refresh_stats()
+            self.stdout.write('Seeded in %.1f s' % (time.perf_counter() - started))
+            results = {name: self.measure(*scenario, options['requests']) for name, *scenario in self.scenarios()}
+
+        self.stdout.write('%-28s %9s %9s %8s %10s' % ('endpoint', 'p50, ms', 'p95, ms', 'queries', 'peak, KB'))
+        for name, r in results.items():
+            self.stdout.write('%-28s %9.1f %9.1f %8d %10.0f' % (
+                name, r['p50_ms'], r['p95_ms'], r['queries'], r['peak_kb']))
+
+        report = {'volumes': volumes, 'seed': options['seed'], 'results': results}
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write('Baseline saved to %s' % options['baseline'])
+        elif os.path.exists(options['baseline']):
+            self.compare(report, options['baseline'], options['tolerance'], options['strict_latency'])
+
+    def scenarios(self):
+        # (название, роль, метод, путь, тело запроса); выгрузки 1С повторяют то, что уже лежит в базе,
+        # поэтому каждый повтор проходит одинаковый путь сравнения без изменений
+        manager = UserProfile.objects.filter(role='MPR').order_by('manager_ID').first().user
+        visit = Visit.objects.filter(status=2).order_by('id').first()
+        prices = [{'productItem': p.product_item, 'priceType': p.price_type, 'amount': p.amount,
+                   'dataBase': p.database} for p in Price.objects.order_by('id')[:1000]]
+        clients = [c.to_dict() for c in Client.objects.order_by('id').with_related()[:200]]
+        return [
+            ('visits limit 500', 'OFFICE', 'get', '/api/visits?limit=500', None),
+            ('visits page 500', 'OFFICE', 'get', '/api/visits?pageSize=500', None),
+            ('visits manager', manager, 'get', '/api/visits', None),
+            ('visits manager since', manager, 'get', '/api/visits?since=0', None),
+            ('visit', 'OFFICE', 'get', '/api/visits/' + visit.UUID, None),
+            ('clients manager', manager, 'get', '/api/clients', None),
+            ('products', 'OFFICE', 'get', '/api/products', None),
+            ('prices', 'OFFICE', 'get', '/api/prices', None),
+            ('checklistsquestions', 'OFFICE', 'get', '/api/checklistsquestions', None),
+            ('stats manager month', 'OFFICE', 'get', '/api/stats?groupBy=manager&period=month', None),
+            ('put prices 1000', '1S', 'put', '/api/prices', prices),
+            ('put clients 200', '1S', 'put', '/api/clients', clients),
+        ]
+
+    def client_for(self, role):
+        # настоящая авторизация по токену, как у мобильного приложения и 1С
+        if isinstance(role, str):
+            user, created = User.objects.get_or_create(username='bench-' + role.lower())
+            UserProfile.objects.filter(user=user).update(role=role)
+        else:
+            user = role
+        token, created = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        return client
+
+    def request(self, client, method, path, body):
+        response = getattr(client, method)(path, body, format='json') if body is not None else \
+            getattr(client, method)(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError('%s %s: %d %s' % (method.upper(), path, response.status_code, response.content[:200]))
+        return response
+
+    def measure(self, role, method, path, body, count):
+        client = self.client_for(role)
+        # прогрев: первое построение сводки статистики и ленивые кэши не должны попадать в замеры
+        self.request(client, method, path, body)
+        timings = []
+        queries = 0
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                self.request(client, method, path, body)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(ctx.captured_queries))
+        # память - отдельным запросом: tracemalloc заметно замедляет выполнение
+        tracemalloc.start()
+        try:
+            self.request(client, method, path, body)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        timings.sort()
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': queries,
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def compare(self, report, path, tolerance, strict_latency):
+        with open(path) as f:
+            baseline = json.load(f)
+        if (baseline['volumes'], baseline['seed']) != (report['volumes'], report['seed']):
+            raise CommandError('Baseline %s was recorded with other volumes or seed, use --save-baseline' % path)
+        failures = []
+        for name, expected in baseline['results'].items():
+            actual = report['results'].get(name)
+            if actual is None:
+                continue
+            # число запросов детерминировано и сравнивается точно, память - с допуском. Из времени берется
+            # медиана: p95 по паре десятков замеров - это один-два случайных выброса
+            if actual['queries'] > expected['queries']:
+                failures.append('%s: %d queries, baseline %d' % (name, actual['queries'], expected['queries']))
+            for metric in ('peak_kb', 'p50_ms') if strict_latency else ('peak_kb',):
+                if actual[metric] > expected[metric] * (1 + tolerance) + NOISE[metric]:
+                    failures.append('%s: %s %.1f, baseline %.1f' % (name, metric, actual[metric], expected[metric]))
+        if failures:
+            raise CommandError('Regressions against %s:\n%s' % (path, '\n'.join(failures)))
+        self.stdout.write('No regressions against %s' % path)
+
+
+def percentile(values, q):
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
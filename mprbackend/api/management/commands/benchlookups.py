@@ -0,0 +1,101 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.bulk import chunks
+from api.management.benchdb import throwaway_database
+from api.models import Order, Price, Product, Visit
+
+# (название, таблица, условие, функция подбора параметров по засеянным данным)
+LOOKUPS = [
+    ('visit by UUID', 'api_visit', '"UUID" = %s', lambda s: [s.rng.choice(s.uuids)]),
+    ('visits by client INN', 'api_visit', '"client_INN" = %s', lambda s: [s.rng.choice(s.inns)]),
+    ('visits by date', 'api_visit', '"date" = %s', lambda s: [s.rng.choice(s.dates)]),
+    ('visits by status', 'api_visit', '"status" = %s', lambda s: [0]),
+    ('order by visit and item', 'api_order', '"visit_id" = %s AND "product_item" = %s',
+     lambda s: [s.rng.choice(s.visit_ids), s.rng.choice(s.items)]),
+    ('price by item, type, DB', 'api_price', '"product_item" = %s AND "price_type" = %s AND "database" = %s',
+     lambda s: [s.rng.choice(s.items), s.rng.choice(s.price_types), True]),
+    ('product by item', 'api_product', '"item" = %s', lambda s: [s.rng.choice(s.items)]),
+]
+
+
+class Command(BaseCommand):
+    help = ('Засевает временную базу визитами и сравнивает стоимость точечных выборок по индексам с полным '
+            'просмотром таблицы (SQLite NOT INDEXED) - то есть "до" и "после" миграции с индексами. '
+            'Рабочая база не затрагивается')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visits', type=int, default=1000000)
+        parser.add_argument('--orders', type=int, default=2, help='строк заказа на визит')
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Сравнение с полным просмотром таблицы поддерживается только для SQLite')
+        self.rng = random.Random(options['seed'])
+        with throwaway_database():
+            self.seed(options['visits'], options['orders'], options['products'])
+            self.run(options['repeat'])
+
+    def run(self, repeat):
+        self.uuids = list(Visit.objects.values_list('UUID', flat=True)[:10000])
+        self.visit_ids = list(Visit.objects.values_list('id', flat=True)[:10000])
+        self.inns = list(Visit.objects.values_list('client_INN', flat=True).distinct()[:1000])
+        self.dates = list(Visit.objects.values_list('date', flat=True).distinct()[:1000])
+        self.items = list(Product.objects.values_list('item', flat=True))
+        self.price_types = list(Price.objects.values_list('price_type', flat=True).distinct())
+
+        self.stdout.write('%-26s %12s %12s %9s  %s' % ('lookup', 'before, ms', 'after, ms', 'speedup', 'plan'))
+        for name, table, where, params in LOOKUPS:
+            before = self.measure('SELECT * FROM %s NOT INDEXED WHERE %s' % (table, where), params, repeat)
+            after = self.measure('SELECT * FROM %s WHERE %s' % (table, where), params, repeat)
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM %s WHERE %s' % (table, where), params(self))
+                plan = '; '.join(row[-1] for row in cursor.fetchall())
+            self.stdout.write('%-26s %12.3f %12.3f %8.1fx  %s' % (name, before, after, before / after, plan))
+
+    def measure(self, sql, params, repeat):
+        # среднее время одного запроса в миллисекундах
+        with connection.cursor() as cursor:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                cursor.execute(sql, params(self))
+                cursor.fetchall()
+            return (time.perf_counter() - started) * 1000 / repeat
+
+    def seed(self, visits, orders, products):
+        Product.objects.bulk_create([Product(item='bench-%d' % i, name='Товар %d' % i) for i in range(products)])
+        Price.objects.bulk_create(
+            [Price(product_item='bench-%d' % i, price_type=t, database=db, amount=str(self.rng.randint(50, 500)))
+             for i in range(products) for t in ('1', '2', '3') for db in (True, False)])
+        self.stdout.write('Seeding %d visits...' % visits)
+        user = User.objects.create(username='bench')
+        today = timezone.now().date()
+        batch = 5000
+        for start in range(0, visits, batch):
+            with transaction.atomic():
+                size = min(batch, visits - start)
+                uuids = [str(uuid.uuid4()) for _ in range(size)]
+                Visit.objects.bulk_create([Visit(
+                    UUID=u,
+                    manager=user,
+                    author=user,
+                    client_INN=str(7700000000 + self.rng.randint(0, 20000)),
+                    date=today - timezone.timedelta(days=self.rng.randint(0, 1000)),
+                    status=self.rng.choice([0, 1, 2, 2, 2, 2]),
+                ) for u in uuids])
+                if orders:
+                    visit_ids = [pk for part in chunks(uuids)
+                                 for pk in Visit.objects.filter(UUID__in=part).values_list('id', flat=True)]
+                    Order.objects.bulk_create([
+                        Order(visit_id=v, product_item='bench-%d' % self.rng.randrange(products))
+                        for v in visit_ids for _ in range(orders)
+                    ])
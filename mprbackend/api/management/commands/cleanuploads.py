@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import PhotoUpload
+from api.uploads import discard_upload
+
+
+class Command(BaseCommand):
+    help = 'Удаляет загрузки фотографий частями, которые не менялись дольше --hours часов, вместе с временными файлами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        q = PhotoUpload.objects.filter(last_modified__lt=timezone.now() - timezone.timedelta(hours=options['hours']))
+        count = 0
+        for upload in q.iterator():
+            discard_upload(upload)
+            count += 1
+        self.stdout.write('Deleted %d uploads' % count)
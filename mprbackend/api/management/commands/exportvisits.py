@@ -0,0 +1,39 @@
+import argparse
+import os
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from api.export import TABLES, export
+
+
+def date(value):
+    # parse_date возвращает None на строке не в формате ГГГГ-ММ-ДД: выгрузка молча шла бы без границы
+    try:
+        result = parse_date(value)
+    except ValueError:
+        result = None
+    if result is None:
+        raise argparse.ArgumentTypeError('expected a date YYYY-MM-DD, got %r' % value)
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Выгружает историю визитов и заказов плоскими таблицами (CSV или колоночные блоки NDJSON) '
+            'потоком из курсора, с постоянным расходом памяти')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument('--format', choices=['csv', 'columns'], default='csv')
+        parser.add_argument('--date-from', type=date)
+        parser.add_argument('--date-to', type=date)
+
+    def handle(self, *args, **options):
+        extension = 'csv' if options['format'] == 'csv' else 'ndjson'
+        os.makedirs(options['output_dir'], exist_ok=True)
+        for table in TABLES:
+            path = os.path.join(options['output_dir'], '%s.%s' % (table, extension))
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in export(table, options['format'], options['date_from'], options['date_to']):
+                    f.write(chunk)
+            self.stdout.write('%s: %s' % (table, path))
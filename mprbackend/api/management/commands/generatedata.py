@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.datagen import DataGenerator
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными для стендов и нагрузочных проверок: менеджеры, клиенты, '
+            'товары, цены, вопросы чек-листа, визиты с заказами и ответами. При том же --seed данные те же, '
+            'повторный запуск добавляет только недостающее')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--managers', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--visits', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=5, help='строк заказа на завершенный визит')
+        parser.add_argument('--answers', type=int, default=3, help='ответов чек-листа на завершенный визит')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000, help='визитов в одной транзакции')
+        parser.add_argument('--prefix', default='gen', help='префикс логинов менеджеров и артикулов товаров')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        generator = DataGenerator(seed=options['seed'], batch_size=options['batch_size'], prefix=options['prefix'],
+                                  log=log)
+        try:
+            created = generator.generate(**{name: options[name] for name in (
+                'managers', 'clients', 'products', 'questions', 'visits', 'orders', 'answers')})
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Created %(visits)d visits, %(orders)d order lines, %(answers)d checklist answers '
+                          'for %(managers)d managers, %(clients)d clients, %(products)d products' % created)
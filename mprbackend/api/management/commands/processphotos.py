@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.imaging import run
+from api.models import Photo
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает фотографии, для которых еще нет уменьшенных копий: загруженные до появления '
+            'фоновой обработки или не обработанные из-за перезапуска сервера')
+
+    def handle(self, *args, **options):
+        ids = list(Photo.objects.filter(processed__isnull=True, visit__isnull=False).values_list('pk', flat=True))
+        for pk in ids:
+            run(pk)
+        self.stdout.write('Processed %d photos' % Photo.objects.filter(pk__in=ids, processed__isnull=False).count())
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.stats import refresh
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводку визитов и заказов за дни, в которых были изменения (--full - за все дни)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Refreshed %d days' % refresh(full=options['full']))
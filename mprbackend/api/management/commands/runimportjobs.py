@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import run
+from api.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = ('Выполняет задания импорта из очереди: оставшиеся после перезапуска сервера или все, если '
+            'IMPORT_WORKERS = 0. --requeue возвращает в очередь задания, прерванные на середине')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            ImportJob.objects.filter(status='running').update(status='queued', started=None)
+        for pk in list(ImportJob.objects.filter(status='queued').order_by('created').values_list('pk', flat=True)):
+            run(pk)
+            job = ImportJob.objects.get(pk=pk)
+            self.stdout.write('%s %s: %s' % (job.pk, job.kind, job.status))
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django import http
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+SIZE_BUCKETS = [1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2]
+
+LABELS = ('route', 'method', 'role')
+
+
+class Histogram:
+    # накопительная гистограмма в формате Prometheus: на каждый набор меток - счетчики по корзинам,
+    # сумма и количество наблюдений
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0}
+        series['buckets'][bisect_left(self.buckets, value)] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        for labels, series in sorted(self.series.items()):
+            label_text = ','.join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in zip(LABELS, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], series['buckets']):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label_text, bound, cumulative))
+            lines.append('%s_sum{%s} %s' % (self.name, label_text, series['sum']))
+            lines.append('%s_count{%s} %d' % (self.name, label_text, series['count']))
+        return lines
+
+
+class Registry:
+    # метрики живут в памяти процесса; при нескольких процессах каждый отдает свои
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'duration': Histogram('mpr_request_duration_seconds', 'Request duration', TIME_BUCKETS),
+            'queries': Histogram('mpr_request_queries', 'SQL queries per request', QUERY_BUCKETS),
+            'sql': Histogram('mpr_request_sql_seconds', 'SQL time per request', TIME_BUCKETS),
+            'render': Histogram('mpr_request_render_seconds',
+                                'Response rendering and streaming time per request', TIME_BUCKETS),
+            'size': Histogram('mpr_response_bytes', 'Response size', SIZE_BUCKETS),
+        }
+
+    def observe(self, labels, values):
+        with self.lock:
+            for name, value in values.items():
+                self.histograms[name].observe(labels, value)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.series.clear()
+
+
+registry = Registry()
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self.size = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # обертка connection.execute_wrapper: каждый SQL-запрос считается и замеряется
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - started
+            self.queries += 1
+
+
+def user_role(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    try:
+        return user.userprofile.role
+    except ObjectDoesNotExist:
+        return 'none'
+
+
+# статистика запроса, который выполняется в этом потоке (представление и middleware работают в одном потоке)
+current = threading.local()
+
+
+class JsonResponse(http.JsonResponse):
+    # JSON-ответы API: JsonResponse кодирует данные в конструкторе, еще внутри представления, поэтому время
+    # кодирования записывается здесь, в статистику текущего запроса - туда же, куда отрисовка ответов DRF
+    def __init__(self, *args, **kwargs):
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        stats = getattr(current, 'stats', None)
+        if stats is not None:
+            stats.render += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    # для каждого запроса: маршрут, роль, количество и время SQL, время отрисовки ответа и его размер.
+    # Потоковый ответ учитывается, когда отдан целиком - запросы к базе при его чтении тоже считаются
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        current.stats = stats
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            current.stats = None
+        if getattr(response, 'file_to_stream', None) is not None:
+            # файл WSGI-сервер может отдать мимо streaming_content (sendfile), поэтому учитываем сразу
+            stats.size = int(response.get('Content-Length', 0))
+            self.record(request, response, stats)
+        elif response.streaming:
+            response.streaming_content = self.stream(request, response, stats, response.streaming_content)
+        else:
+            stats.size = len(response.content)
+            self.record(request, response, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        # ответы DRF отрисовываются после представления: это время сериализации
+        started = time.perf_counter()
+        stats = current.stats
+
+        def rendered(response):
+            stats.render += time.perf_counter() - started
+        response.add_post_render_callback(rendered)
+        return response
+
+    def stream(self, request, response, stats, content):
+        try:
+            while True:
+                started = time.perf_counter()
+                with connection.execute_wrapper(stats):
+                    chunk = next(content, None)
+                stats.render += time.perf_counter() - started
+                if chunk is None:
+                    break
+                stats.size += len(chunk)
+                yield chunk
+        finally:
+            self.record(request, response, stats)
+
+    def record(self, request, response, stats):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        role = user_role(request)
+        duration = time.perf_counter() - stats.started
+        registry.observe((route, request.method, role), {
+            'duration': duration,
+            'queries': stats.queries,
+            'sql': stats.sql,
+            'render': stats.render,
+            'size': stats.size,
+        })
+        if duration * 1000 > settings.METRICS_SLOW_REQUEST_MS or stats.queries > settings.METRICS_MAX_QUERIES:
+            logger.warning('Slow request %s %s (route %s, role %s): status %d, %.0f ms, %d queries in %.0f ms, '
+                           'render %.0f ms, %d bytes', request.method, request.path, route, role,
+                           response.status_code, duration * 1000, stats.queries, stats.sql * 1000,
+                           stats.render * 1000, stats.size)
@@ -0,0 +1,69 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:11
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_auto_20200614_1425'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Price',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_item', models.CharField(max_length=200)),
+                ('price_type', models.CharField(max_length=200)),
+                ('amount', models.CharField(max_length=200)),
+                ('database', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item', models.CharField(max_length=200)),
+                ('name', models.CharField(blank=True, max_length=400, null=True)),
+                ('description', models.CharField(blank=True, max_length=400, null=True)),
+                ('active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='address',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='latitude',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='longitude',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='checklistquestion',
+            name='section',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='UUID',
+            field=models.CharField(default=uuid.uuid4, max_length=36, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='invoice',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='processed',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+    ]
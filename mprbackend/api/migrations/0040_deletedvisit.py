@@ -0,0 +1,27 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0039_auto_20261018_1011'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedVisit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('UUID', models.CharField(max_length=36)),
+                ('client_INN', models.CharField(max_length=200)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('deleted', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('manager', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    # перед созданием уникальных ограничений оставляем последнюю по id запись для каждого ключа
+    for model_name, key in (('Price', ['product_item', 'price_type', 'database']), ('Product', ['item'])):
+        model = apps.get_model('api', model_name)
+        keep = model.objects.values(*key).annotate(last_id=models.Max('id')).values('last_id')
+        model.objects.exclude(id__in=keep).delete()
+
+
+def merge_duplicate_visits(apps, schema_editor):
+    # PUT визита раньше делал get() и create() без блокировки, и параллельные запросы могли создать
+    # два визита с одним UUID. Оставляем измененный последним (его заказ и ответы - самые свежие),
+    # фотографии остальных переносим на него, остальные удаляем вместе с их заказами и ответами
+    Visit = apps.get_model('api', 'Visit')
+    Photo = apps.get_model('api', 'Photo')
+    duplicated = Visit.objects.values('UUID').annotate(n=models.Count('id')).filter(n__gt=1).values_list(
+        'UUID', flat=True)
+    for visit_uuid in list(duplicated):
+        keep, *others = Visit.objects.filter(UUID=visit_uuid).order_by('-last_modified', '-id').values_list(
+            'id', flat=True)
+        Photo.objects.filter(visit_id__in=others).update(visit_id=keep)
+        Visit.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_deletedvisit'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicate_visits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='item',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='UUID',
+            field=models.CharField(max_length=36, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='client_INN',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='status',
+            field=models.SmallIntegerField(db_index=True, default=-1),
+        ),
+        migrations.AlterUniqueTogether(
+            name='price',
+            unique_together={('product_item', 'price_type', 'database')},
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['visit', 'product_item'], name='api_order_visit_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['manager', 'date'], name='api_visit_manager_date_idx'),
+        ),
+    ]
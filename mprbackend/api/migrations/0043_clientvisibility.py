@@ -0,0 +1,36 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_visibility(apps, schema_editor):
+    Client = apps.get_model('api', 'Client')
+    ClientVisibility = apps.get_model('api', 'ClientVisibility')
+    rows = set(Client.objects.filter(manager__isnull=False).values_list('manager_id', 'id'))
+    rows.update(Client.authorized_managers.through.objects.values_list('user_id', 'client_id'))
+    ClientVisibility.objects.bulk_create([ClientVisibility(manager_id=m, client_id=c) for m, c in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0042_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='api.Client')),
+                ('manager', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('manager', 'client')},
+            },
+        ),
+        migrations.RunPython(fill_visibility, migrations.RunPython.noop),
+    ]
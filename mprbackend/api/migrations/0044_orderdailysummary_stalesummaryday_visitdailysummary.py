@@ -0,0 +1,59 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0043_clientvisibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleSummaryDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VisitDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('client_INN', models.CharField(max_length=200)),
+                ('visits', models.IntegerField(default=0)),
+                ('payment', models.FloatField(default=0)),
+                ('payment_plan', models.FloatField(default=0)),
+                ('refreshed', models.DateTimeField()),
+                ('manager', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('date', 'manager', 'client_INN')},
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('client_INN', models.CharField(max_length=200)),
+                ('product_item', models.CharField(max_length=200)),
+                ('lines', models.IntegerField(default=0)),
+                ('order', models.IntegerField(default=0)),
+                ('sales', models.IntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('recommend', models.IntegerField(default=0)),
+                ('balance', models.IntegerField(default=0)),
+                ('refreshed', models.DateTimeField()),
+                ('manager', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('date', 'manager', 'client_INN', 'product_item')},
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:31
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_orderdailysummary_stalesummaryday_visitdailysummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to=api.models.photo_variant_path),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='web',
+            field=models.ImageField(blank=True, null=True, upload_to=api.models.photo_variant_path),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
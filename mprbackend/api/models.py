@@ -1,8 +1,12 @@
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+import json
+import os
+import threading
 import uuid
 
 
@@ -40,22 +44,64 @@ def create_user_profile(sender, instance, created, **kwargs):
 #     instance.userprofile.save()
 
 
+class VisitQuerySet(models.QuerySet):
+    def with_related(self):
+        # менеджер, автор и заказы подгружаются фиксированным числом запросов
+        # независимо от количества визитов в выборке
+        return self.select_related('manager__userprofile', 'author__userprofile').prefetch_related('order_set')
+
+    def delete(self):
+        # следы удаления для всей выборки - одним bulk_create, а не INSERT из post_delete на каждый визит
+        with transaction.atomic():
+            DeletedVisit.objects.bulk_create([
+                DeletedVisit(UUID=u, manager_id=m, client_INN=inn, date=d)
+                for u, m, inn, d in self.values_list('UUID', 'manager_id', 'client_INN', 'date').iterator()
+            ])
+            bulk_delete.active = True
+            try:
+                return super().delete()
+            finally:
+                bulk_delete.active = False
+
+
+# удаление выборки визитов (VisitQuerySet.delete) уже записало следы удаления, сигналу писать не нужно
+bulk_delete = threading.local()
+
+
 class Visit(models.Model):
-    UUID = models.CharField(max_length=36)
-    date = models.DateField(null=True, blank=True)
+    UUID = models.CharField(max_length=36, unique=True)
+    date = models.DateField(null=True, blank=True, db_index=True)
     database = models.BooleanField(default=True, null=True, blank=True)
-    client_INN = models.CharField(max_length=200)
+    client_INN = models.CharField(max_length=200, db_index=True)
     payment = models.FloatField(null=True, blank=True)
     payment_plan = models.FloatField(null=True, blank=True)
     manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='manager')
     processed = models.CharField(max_length=200, null=True, blank=True)
     invoice = models.CharField(max_length=200, null=True, blank=True)
-    status = models.SmallIntegerField(default=-1)
+    status = models.SmallIntegerField(default=-1, db_index=True)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='author')
     created = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
-    last_modified = models.DateTimeField(auto_now=True, editable=False, null=False, blank=False)
+    last_modified = models.DateTimeField(auto_now=True, editable=False, null=False, blank=False, db_index=True)
     delivery_date = models.DateField(null=True, blank=True)
 
+    objects = VisitQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # визиты МПР: фильтр по менеджеру с сортировкой по дате
+            models.Index(fields=['manager', 'date'], name='api_visit_manager_date_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # дата на момент загрузки: при переносе визита на другой день сводку за старый день тоже нужно пересчитать
+        instance._loaded_date = instance.__dict__.get('date')
+        # владелец на момент загрузки: если визит передадут другому менеджеру или клиенту, прежнему
+        # нужен след удаления, иначе дельта-синхронизация оставит ему устаревшую копию
+        instance._loaded_owner = (instance.__dict__.get('manager_id'), instance.__dict__.get('client_INN'))
+        return instance
+
     def __str__(self):
         return str(self.date) + ' ' + self.manager.first_name + ' ' + self.manager.last_name + ' в ' + self.client_INN
 
@@ -82,7 +128,8 @@ class Visit(models.Model):
         if self.invoice:
             result['invoice'] = self.invoice
 
-        orders = Order.objects.filter(visit=self)
+        # order_set.all() использует кэш prefetch_related, если он есть
+        orders = self.order_set.all()
         orders_array = [{
             'productItem': o.product_item,
             'order': o.order,
@@ -95,59 +142,100 @@ class Visit(models.Model):
         return result
 
     def update_from_dict(self, data):
-        if 'dataBase' in data:
-            self.database = data['dataBase']
+        # визит и строки его заказа пишутся одной транзакцией
+        with transaction.atomic():
+            if 'dataBase' in data:
+                self.database = data['dataBase']
 
-        if 'invoice' in data:
-            self.invoice = data['invoice']
+            if 'invoice' in data:
+                self.invoice = data['invoice']
 
-        if 'processed' in data:
-            self.processed = data['processed']
+            if 'processed' in data:
+                self.processed = data['processed']
 
-        if 'status' in data:
-            self.status = int(data['status'])
+            if 'status' in data:
+                self.status = int(data['status'])
 
-        if 'managerID' in data:
-            self.manager = User.objects.get(userprofile__manager_ID=data['managerID'])
+            if 'managerID' in data:
+                self.manager = User.objects.get(userprofile__manager_ID=data['managerID'])
 
-        if ('author' in data) and data['author']:
-            self.author = User.objects.get(userprofile__manager_ID=data['author'])
+            if ('author' in data) and data['author']:
+                self.author = User.objects.get(userprofile__manager_ID=data['author'])
 
-        if 'date' in data:
-            self.date = data['date']
+            if 'date' in data:
+                self.date = data['date']
 
-        if 'deliveryDate' in data:
-            self.delivery_date = data['deliveryDate']
+            if 'deliveryDate' in data:
+                self.delivery_date = data['deliveryDate']
 
-        if 'payment' in data:
-            self.payment = int(data['payment'])
+            if 'payment' in data:
+                self.payment = int(data['payment'])
 
-        if 'paymentPlan' in data:
-            self.payment_plan = int(data['paymentPlan'])
+            if 'paymentPlan' in data:
+                self.payment_plan = int(data['paymentPlan'])
 
-        if 'clientINN' in data:
-            self.client_INN = data['clientINN']
+            if 'clientINN' in data:
+                self.client_INN = data['clientINN']
 
-        self.save()
+            self.save()
+
+            if 'orders' in data:
+                self.update_orders(data['orders'])
+
+    def update_orders(self, orders):
+        # строки заказа читаются одним запросом, новые и измененные пишутся пачками
+        existing = {o.product_item: o for o in Order.objects.filter(visit=self)}
+        to_create, to_update = {}, {}
+        for o in orders:
+            item = o['productItem']
+            dbo = existing.get(item)
+            if dbo is None:
+                dbo = to_create.setdefault(item, Order(visit=self, product_item=item))
+            for field in Order.DATA_FIELDS:
+                if field in o and getattr(dbo, field) != o[field]:
+                    setattr(dbo, field, o[field])
+                    if dbo.pk:
+                        to_update[item] = dbo
+
+        now = timezone.now()
+        for dbo in to_update.values():
+            dbo.last_modified = now
+        Order.objects.bulk_create(to_create.values())
+        Order.objects.bulk_update(to_update.values(), Order.DATA_FIELDS + ['last_modified'])
+
+
+class DeletedVisit(models.Model):
+    # след удаленного визита, чтобы мобильное приложение при дельта-синхронизации узнало об удалении
+    UUID = models.CharField(max_length=36)
+    # без ограничения в БД: визиты удаляются каскадом и при удалении самого менеджера
+    manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False,
+                                related_name='+')
+    client_INN = models.CharField(max_length=200)
+    date = models.DateField(null=True, blank=True)
+    deleted = models.DateTimeField(auto_now_add=True, db_index=True)
 
-        if 'orders' in data:
-            orders = data['orders']
-            for o in orders:
-                try:
-                    dbo = Order.objects.get(visit=self, product_item=o['productItem'])
-                except Order.DoesNotExist:
-                    dbo = Order(visit=self, product_item=o['productItem'])
-                if 'order' in o:
-                    dbo.order = o['order']
-                if 'sales' in o:
-                    dbo.sales = o['sales']
-                if 'delivered' in o:
-                    dbo.delivered = o['delivered']
-                if 'recommend' in o:
-                    dbo.recommend = o['recommend']
-                if 'balance' in o:
-                    dbo.balance = o['balance']
-                dbo.save()
+
+@receiver(post_delete, sender=Visit)
+def create_deleted_visit(sender, instance, **kwargs):
+    # удаление одного визита или каскадом от менеджера
+    if getattr(bulk_delete, 'active', False):
+        return
+    DeletedVisit.objects.create(
+        UUID=instance.UUID,
+        manager_id=instance.manager_id,
+        client_INN=instance.client_INN,
+        date=instance.date)
+
+
+@receiver(post_save, sender=Visit)
+def create_reassigned_visit(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_owner', None)
+    owner = (instance.manager_id, instance.client_INN)
+    if not created and loaded is not None and None not in loaded and loaded != owner:
+        # для прежнего менеджера и клиента визит как будто удален
+        DeletedVisit.objects.create(UUID=instance.UUID, manager_id=loaded[0], client_INN=loaded[1],
+                                    date=getattr(instance, '_loaded_date', None) or instance.date)
+    instance._loaded_owner = owner
 
 
 class Order(models.Model):
@@ -159,12 +247,65 @@ class Order(models.Model):
     balance = models.SmallIntegerField(null=True, blank=True, default=0)
     sales = models.SmallIntegerField(null=True, blank=True, default=0)
     created = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
-    last_modified = models.DateTimeField(auto_now=True, editable=False, null=False, blank=False)
+    last_modified = models.DateTimeField(auto_now=True, editable=False, null=False, blank=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['visit', 'product_item'], name='api_order_visit_item_idx'),
+        ]
+
+    # поля строки заказа, которые приходят в данных визита под теми же именами
+    DATA_FIELDS = ['order', 'sales', 'delivered', 'recommend', 'balance']
 
     def __str__(self):
         return 'Визит №' + str(self.visit.id) + ' от ' + str(self.visit.date) + ', арт. ' + str(self.product_item)
 
 
+class VisitDailySummary(models.Model):
+    # сводка визитов за день по менеджеру и клиенту, пересчитывается инкрементально (см. api.stats)
+    date = models.DateField()
+    manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    client_INN = models.CharField(max_length=200)
+    visits = models.IntegerField(default=0)
+    payment = models.FloatField(default=0)
+    payment_plan = models.FloatField(default=0)
+    refreshed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('date', 'manager', 'client_INN')
+
+
+class OrderDailySummary(models.Model):
+    # сводка строк заказа за день по менеджеру, клиенту и артикулу
+    date = models.DateField()
+    manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    client_INN = models.CharField(max_length=200)
+    product_item = models.CharField(max_length=200)
+    lines = models.IntegerField(default=0)
+    order = models.IntegerField(default=0)
+    sales = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    recommend = models.IntegerField(default=0)
+    balance = models.IntegerField(default=0)
+    refreshed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('date', 'manager', 'client_INN', 'product_item')
+
+
+class StaleSummaryDay(models.Model):
+    # день, с которого визит перенесли на другую дату: по last_modified его уже не найти
+    date = models.DateField(unique=True)
+
+
+@receiver(post_save, sender=Visit)
+def mark_stale_summary_day(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_date', None)
+    if not created and loaded is not None and str(loaded) != str(instance.date):
+        StaleSummaryDay.objects.get_or_create(date=loaded)
+    instance._loaded_date = instance.date
+
+
 class ChecklistQuestion(models.Model):
     UUID = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     client_type = models.CharField(max_length=200)
@@ -195,7 +336,7 @@ class ChecklistAnswer(models.Model):
     def to_dict(self):
         result = {
             'UUID': self.UUID,
-            'questionUUID': self.question.UUID,
+            'questionUUID': self.question_id,
             'visitUUID': self.visit.UUID
         }
         if self.answer1:
@@ -205,6 +346,18 @@ class ChecklistAnswer(models.Model):
         return result
 
 
+class ClientQuerySet(models.QuerySet):
+    def with_related(self):
+        # основной и авторизованные менеджеры с профилями подгружаются фиксированным числом запросов
+        return self.select_related('manager__userprofile').prefetch_related(
+            models.Prefetch('authorized_managers', queryset=User.objects.select_related('userprofile')))
+
+    def visible_to(self, manager):
+        # клиенты, где менеджер основной или авторизованный: выборка по индексу ClientVisibility
+        # вместо OR по связи многие-ко-многим с DISTINCT
+        return self.filter(visibility__manager=manager)
+
+
 class Client(models.Model):
     name = models.CharField(max_length=200)
     INN = models.CharField(max_length=12, unique=True)
@@ -224,6 +377,8 @@ class Client(models.Model):
     longitude = models.CharField(max_length=100, blank=True, null=True)
     latitude = models.CharField(max_length=100, blank=True, null=True)
 
+    objects = ClientQuerySet.as_manager()
+
     def __str__(self):
         return self.name
     # TODO: сделать проверку корректности и исправление заполнения мнеджеров
@@ -243,8 +398,8 @@ class Client(models.Model):
             'priceType': self.price_type,
             'delay': self.delay,
             'limit': self.limit,
-            'authorizedManagersID': list(
-                self.authorized_managers.all().values_list('userprofile__manager_ID', flat=True)),
+            # authorized_managers.all() использует кэш prefetch_related, если он есть
+            'authorizedManagersID': [m.userprofile.manager_ID for m in self.authorized_managers.all()],
             'address': self.address,
             'email': self.email,
             'phone': self.phone,
@@ -310,6 +465,45 @@ class Client(models.Model):
         self.save()
 
 
+class ClientVisibility(models.Model):
+    # денормализованный индекс видимости: менеджер -> клиенты, где он основной или авторизованный менеджер.
+    # Поддерживается сигналами при записи отдельных клиентов и явным refresh() в массовой синхронизации
+    manager = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='visibility')
+
+    class Meta:
+        unique_together = [['manager', 'client']]
+
+    @classmethod
+    def refresh(cls, client_ids):
+        client_ids = list(client_ids)
+        through = Client.authorized_managers.through
+        for i in range(0, len(client_ids), 500):
+            batch = client_ids[i:i + 500]
+            rows = set(Client.objects.filter(pk__in=batch, manager__isnull=False).values_list('manager_id', 'id'))
+            rows.update(through.objects.filter(client_id__in=batch).values_list('user_id', 'client_id'))
+            cls.objects.filter(client_id__in=batch).delete()
+            cls.objects.bulk_create([cls(manager_id=manager_id, client_id=client_id) for manager_id, client_id in rows])
+
+
+@receiver(post_save, sender=Client)
+def refresh_client_visibility(sender, instance, **kwargs):
+    ClientVisibility.refresh([instance.pk])
+
+
+@receiver(m2m_changed, sender=Client.authorized_managers.through)
+def refresh_authorized_visibility(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        ClientVisibility.refresh([instance.pk])
+    elif action == 'post_clear':
+        # у менеджера сняли всех клиентов: пересчитываем тех, кого он видел
+        ClientVisibility.refresh(ClientVisibility.objects.filter(manager=instance).values_list('client_id', flat=True))
+    else:
+        ClientVisibility.refresh(pk_set)
+
+
 # @receiver(post_save, sender=Client)
 # def complete_managers_relations(instance, **kwargs):
 #     print('before all')
@@ -335,14 +529,69 @@ def photo_path(instance, filename):
     return '/'.join(['photos', instance.visit.client_INN, filename])
 
 
+def photo_variant_path(instance, filename):
+    return '/'.join(['photos', instance.visit.client_INN, 'variants', filename])
+
+
+class PhotoBlob(models.Model):
+    # содержимое фотографии, хранится один раз под своим SHA-256; фотографии визитов ссылаются на него
+    digest = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(max_length=200)
+    size = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
+
+
+def blob_path(digest, filename):
+    extension = os.path.splitext(filename)[1].lower() or '.jpg'
+    return '/'.join(['photos', 'blobs', digest[:2], digest + extension])
+
+
 class Photo(models.Model):
     visit = models.ForeignKey(Visit, null=True, blank=True, on_delete=models.DO_NOTHING)
     image = models.ImageField(upload_to=photo_path)
+    # у фотографий, загруженных до хранения по хэшу, blob пустой, а image указывает на собственный файл
+    blob = models.ForeignKey(PhotoBlob, on_delete=models.PROTECT, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now=True)
+    # заполняются фоновой обработкой (api.imaging): размеры и объем оригинала, уменьшенные копии без EXIF
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    thumbnail = models.ImageField(upload_to=photo_variant_path, null=True, blank=True)
+    web = models.ImageField(upload_to=photo_variant_path, null=True, blank=True)
+    processed = models.DateTimeField(null=True, blank=True, db_index=True)
+
+
+class PhotoUpload(models.Model):
+    # загрузка фотографии частями: куски пишутся во временный файл по смещению, received - сколько байт
+    # подряд с начала файла уже на диске. После завершения файл переносится в хранилище
+    UUID = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    filename = models.CharField(max_length=200)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # несколько загрузок одного и того же снимка в визит дают одну фотографию
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
+    last_modified = models.DateTimeField(auto_now=True, editable=False, null=False, blank=False, db_index=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', str(self.UUID))
+
+    def to_dict(self):
+        result = {
+            'uploadID': self.UUID,
+            'size': self.size,
+            'offset': self.received
+        }
+        if self.photo_id:
+            result['photoID'] = self.photo_id
+        return result
 
 
 class Task(models.Model):
-    UUID = models.CharField(max_length=36, default=uuid.uuid4(), unique=True)
+    UUID = models.CharField(max_length=36, default=uuid.uuid4, unique=True)
     manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, null=True, blank=True)
     text = models.TextField(blank=True, null=True)
     title = models.TextField(blank=True, null=True)
@@ -387,12 +636,15 @@ class Price(models.Model):
     amount = models.CharField(max_length=200)
     database = models.BooleanField(default=True)
 
+    class Meta:
+        unique_together = [['product_item', 'price_type', 'database']]
+
     def __str__(self):
         return "Цена на" + str(self.product_item) + " для " + str(self.price_type) + "; БД: " + str(self.database)
 
 
 class Product(models.Model):
-    item = models.CharField(max_length=200)
+    item = models.CharField(max_length=200, unique=True)
     name = models.CharField(max_length=400, blank=True, null=True)
     description = models.CharField(max_length=400, blank=True, null=True)
     active = models.BooleanField(default=True)
@@ -400,3 +652,84 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+
+class ImportJob(models.Model):
+    # выгрузка из 1С, принятая для фоновой обработки (api.jobs): данные лежат в базе до конца импорта.
+    # partial - ошибка после того, как первые processed строк уже применены
+    STATUSES = ['queued', 'running', 'done', 'failed', 'partial']
+
+    UUID = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # SHA-256 данных: повтор той же выгрузки, пока она ждет в очереди, не создает второе задание
+    digest = models.CharField(max_length=64, db_index=True)
+    payload = models.TextField()
+    status = models.CharField(max_length=20, default='queued', db_index=True)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def to_dict(self):
+        result = {
+            'id': self.UUID,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'created': self.created
+        }
+        if self.started:
+            result['started'] = self.started
+        if self.finished:
+            result['finished'] = self.finished
+        if self.result:
+            result['result'] = json.loads(self.result)
+        if self.error:
+            result['error'] = self.error
+        return result
+
+
+class DataVersion(models.Model):
+    # счетчик изменений таблицы справочных данных, из него строится ETag для GET-запросов.
+    # Сигналы увеличивают его при записи отдельных объектов, массовые операции - явно через bump()
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls, *names):
+        for name in names:
+            if not cls.objects.filter(name=name).update(version=models.F('version') + 1):
+                cls.objects.get_or_create(name=name, defaults={'version': 1})
+
+    @classmethod
+    def get(cls, *names):
+        versions = dict(cls.objects.filter(name__in=names).values_list('name', 'version'))
+        return [versions.get(name, 0) for name in names]
+
+
+VERSIONED_MODELS = {
+    UserProfile: 'userprofile',
+    Client: 'client',
+    ChecklistQuestion: 'checklistquestion',
+    Price: 'price',
+    Product: 'product',
+}
+
+
+def bump_data_version(sender, **kwargs):
+    DataVersion.bump(VERSIONED_MODELS[sender])
+
+
+for versioned in VERSIONED_MODELS:
+    post_save.connect(bump_data_version, sender=versioned)
+    post_delete.connect(bump_data_version, sender=versioned)
+
+
+@receiver(m2m_changed, sender=Client.authorized_managers.through)
+def bump_client_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        DataVersion.bump('client')
@@ -0,0 +1,118 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import JsonResponse
+
+# сколько строк читать из базы за один раз при потоковой выгрузке
+STREAM_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 10000
+
+# СУБД, у которых NULL при сортировке по возрастанию идут первыми (PostgreSQL и Oracle ставят их последними)
+NULLS_FIRST_VENDORS = {'sqlite', 'mysql'}
+
+
+class Keyset:
+    # стабильный ключ сортировки для постраничной выборки "строки после курсора" вместо OFFSET:
+    # каждая страница - это поиск по индексу, а не пропуск всех предыдущих строк
+    def __init__(self, model, *fields):
+        self.fields = [model._meta.get_field(f) for f in fields]
+
+    def order(self, q):
+        # обычный ORDER BY по полям ключа совпадает с индексом; NULLS FIRST/LAST заставил бы SQLite
+        # сортировать весь остаток выборки на каждой странице. Где окажутся NULL, решает СУБД (after)
+        return q.order_by(*[f.attname for f in self.fields])
+
+    def after(self, q, values):
+        # (k1, k2, ...) > (v1, v2, ...) в лексикографическом порядке
+        nulls_first = connections[q.db].vendor in NULLS_FIRST_VENDORS
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            if value is None:
+                greater = Q(**{field.attname + '__isnull': False}) if nulls_first else None
+                same = Q(**{field.attname + '__isnull': True})
+            else:
+                greater = Q(**{field.attname + '__gt': value})
+                if field.null and not nulls_first:
+                    greater |= Q(**{field.attname + '__isnull': True})
+                same = Q(**{field.attname: value})
+            if greater is not None:
+                condition |= equal & greater
+            equal &= same
+        return q.filter(condition) if condition else q.none()
+
+    def encode(self, obj):
+        values = [getattr(obj, f.attname) for f in self.fields]
+        raw = json.dumps(values, cls=DjangoJSONEncoder).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode(self, cursor):
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise ValueError('Bad cursor')
+        return [None if v is None else f.to_python(v) for f, v in zip(self.fields, values)]
+
+    def pages(self, q, size=STREAM_PAGE_SIZE):
+        q = self.order(q)
+        page = list(q[:size])
+        while page:
+            yield page
+            if len(page) < size:
+                return
+            page = list(self.after(q, [getattr(page[-1], f.attname) for f in self.fields])[:size])
+
+
+def stream_json(q, keyset, serialize):
+    # JSON-массив пишется по страницам, в памяти одновременно не больше одной страницы
+    encoder = DjangoJSONEncoder()
+    yield '['
+    separator = ''
+    for page in keyset.pages(q):
+        items = serialize(page)
+        if items:
+            yield separator + ','.join(encoder.encode(item) for item in items)
+            separator = ','
+    yield ']'
+
+
+def list_response(request, q, keyset, serialize):
+    # общий ответ для списочных эндпоинтов:
+    #   без параметров - весь список, как раньше; limit - первые limit строк;
+    #   pageSize/cursor - страница {"results": [...], "next": курсор следующей страницы или null};
+    #   stream=true - весь список потоком, без материализации в памяти
+    params = request.query_params
+    if params.get('stream') in ('true', 'True'):
+        return StreamingHttpResponse(stream_json(q, keyset, serialize), content_type='application/json')
+
+    try:
+        limit = int(params['limit']) if params.get('limit') else None
+        page_size = int(params['pageSize']) if params.get('pageSize') else None
+        cursor = keyset.decode(params['cursor']) if params.get('cursor') else None
+    except (ValueError, TypeError, ValidationError):
+        return Response("Bad limit, pageSize or cursor value", status=status.HTTP_400_BAD_REQUEST)
+    if (limit is not None and limit < 1) or (page_size is not None and page_size < 1):
+        return Response("Bad limit, pageSize or cursor value", status=status.HTTP_400_BAD_REQUEST)
+
+    if page_size is None and cursor is None:
+        if limit:
+            q = keyset.order(q)[:min(limit, MAX_PAGE_SIZE)]
+        return JsonResponse(serialize(q), safe=False, status=status.HTTP_200_OK)
+
+    page_size = min(page_size or STREAM_PAGE_SIZE, MAX_PAGE_SIZE)
+    q = keyset.order(q)
+    if cursor is not None:
+        q = keyset.after(q, cursor)
+    page = list(q[:page_size + 1])
+    result = {
+        'results': serialize(page[:page_size]),
+        'next': keyset.encode(page[page_size - 1]) if len(page) > page_size else None
+    }
+    return JsonResponse(result, status=status.HTTP_200_OK)
@@ -0,0 +1,341 @@
+import jsonschema
+from django.conf import settings
+
+clients_schema = {
+    "type": "array",
+    "items": {
+        "title": "Клиент",
+        "type": "object",
+        "description": "Данные клиента",
+        "x-examples": {},
+        "x-tags": [
+            "1С",
+            "Офис",
+            "Фронтенд"
+        ],
+        "properties": {
+            "name": {
+                "type": "string",
+                "description": "Наименование клиента для отображения пользователю"
+            },
+            "inn": {
+                "type": "string",
+                "description": "ИНН"
+            },
+            "clientType": {
+                "type": "string",
+                "description": "Тип клиента (хорека, драфт, магазин etc)"
+            },
+            "priceType": {
+                "type": "string",
+                "description": "Тип цен для клиента"
+            },
+            "delay": {
+                "type": "integer",
+                "default": 0,
+                "description": "Отсрочка по договору",
+                "format": "int32",
+                "example": 0,
+                "minimum": 0
+            },
+            "limit": {
+                "type": "integer",
+                "default": 0,
+                "description": "Лимит",
+                "format": "int64",
+                "example": 0,
+                "minimum": 0
+            },
+            "authorizedManagersID": {
+                "type": "array",
+                "description": "Массив ID менеджеров, для которых доступен клиент",
+                "items": {
+                    "type": "string"
+                }
+            },
+            "email": {
+                "type": "string",
+                "format": "email"
+            },
+            "phone": {
+                "type": "string"
+            },
+            "manager": {
+                "type": "string",
+                "description": "ID основного менеджера"
+            },
+            "longitude": {
+                "type": "string"
+            },
+            "latitude": {
+                "type": "string"
+            },
+            "status": {
+                "type": "boolean",
+                "default": "1",
+                "description": "Действует/не действует"
+            },
+            "dataBase": {
+                "type": "boolean",
+                "description": "false - тест, true - ПБК"
+            },
+            "address": {
+                "type": "string",
+                "description": "Адрес клиента"
+            }
+        },
+        "required": [
+            "inn"
+        ]
+    },
+}
+
+visit_schema = {
+    "title": "Визит",
+    "type": "object",
+    "description": "Данные по визитам",
+    "properties": {
+        "orders": {
+            "type": "array",
+            "description": "Массив данных о заказанных продуктах, остатке, продажах",
+            "items": {
+                "title": "Объект заказа",
+                "type": "object",
+                "description": "Объект описания заказанного, рекомендованного к заказу, остаточного и отгруженного "
+                               "товара",
+                "properties": {
+                    "productItem": {
+                        "type": "string",
+                        "description": "Артикул продукта. Генерируется приложением МПР, никогда не изменяется"
+                    },
+                    "order": {
+                        "type": "integer",
+                        "description": "Заказанное количество продукта. Генерируется приложением МПР, изменяется "
+                                       "приложением офиса "
+                    },
+                    "delivered": {
+                        "description": "Количество поставленного продукт. По умолчанию установлено в 0, обновляется "
+                                       "со стороны 1С",
+                        "type": "integer"
+                    },
+                    "recommend": {
+                        "type": "integer",
+                        "description": "Рекомендованное к заказу количесво. Генерируется приложением МПР и никогда не "
+                                       "изменяется "
+                    },
+                    "balance": {
+                        "description": "Остаток продукта у клиента. Генерируется приложением МПР, изменяется "
+                                       "приложением офиса",
+                        "type": "integer"
+                    },
+                    "sales": {
+                        "type": "integer",
+                        "description": "Продажи продкукта. Генерируется приложением МПР, изменяется приложением офиса"
+                    }
+                },
+                "required": [
+                    "productItem"
+                ]
+            }
+        },
+        "UUID": {
+            "type": "string",
+            "description": "Уникальный идентификатор визита. Генерируется приложением МПР или офиса и никогда не изменяется",
+            "format": "uuid"
+        },
+        "date": {
+            "type": "string",
+            "format": "date",
+            "description": "Дата совершения визита. Генерируется приложением МПР и никогда не изменяется"
+        },
+        "dataBase": {
+            "type": "boolean"
+        },
+        "clientINN": {
+            "type": "string",
+            "description": "ИНН клиента. Генерируется приложением МПР или офиса и никогда не изменяется"
+        },
+        "payment": {
+            "description": "Сумма денег, принятых в счет оплаты. Генерируется приложением МПР, обновляется приложением офиса",
+            "type": "integer"
+        },
+        "processed": {
+            "type": "string",
+            "description": "Номер накладной. Устанавливается в true со стороны 1С при создании накладной"
+        },
+        "invoice": {
+            "type": "string",
+            "description": "Номер ПКО. Устанавливается в true со стороны 1С при создании ПКО"
+        },
+        "status": {
+            "type": "integer",
+            "description": "Статус визита 0: не начат, 1: в работе, 2: завершен. Генерируется и обновляется приложениями МПР и офиса"
+        },
+        "managerID": {
+            "type": "string",
+            "description": "ID менеджера, который совершил (совершает) визит. Генерируется приложением МПР или офиса, никогда не изменяется"
+        },
+        "paymentPlan": {
+            "type": "integer"
+        },
+        "author": {
+            "type": "string",
+            "description": "ID автора визита"
+        },
+        "id": {
+            "type": "integer",
+            "description": "Человекочитаемый ID"
+        },
+        "deliveryDate": {
+            "type": "string",
+            "format": "date",
+            "description": "Дата доставки"
+        }
+    },
+}
+
+checklistanswers_schema = {
+    "type": "array",
+    "items":
+        {
+            "type": "object",
+            "properties": {
+                "questionUUID": {
+                    "type": "string",
+                    "description": "UUID вопроса",
+                    "format": "uuid"
+                },
+                "visitUUID": {
+                    "type": "string",
+                    "description": "UUID визита, в котором был дан ответ",
+                    "format": "uuid"
+                },
+                "answer1": {
+                    "type": [
+                        "string",
+                        "boolean"
+                    ],
+                    "description": "Ответ на вопрос/количество"
+                },
+                "answer2": {
+                    "type": "string",
+                    "description": "Примечание/цена"
+                },
+                "UUID": {
+                    "type": "string",
+                    "description": "UUID ответа",
+                    "format": "uuid"
+                }
+            },
+            "required": [
+                "questionUUID",
+                "visitUUID"
+            ]
+        }
+}
+
+
+prices_schema = {
+    "type": "array",
+    "items": {
+        "title": "Цена",
+        "type": "object",
+        "properties": {
+            "productItem": {
+                "type": "string",
+                "minLength": 1,
+                "maxLength": 200,
+                "description": "Артикул продукта"
+            },
+            "priceType": {
+                "type": "string",
+                "maxLength": 200,
+                "description": "Тип цен"
+            },
+            "amount": {
+                "type": ["string", "number"],
+                "maxLength": 200,
+                "description": "Цена"
+            },
+            "dataBase": {
+                "type": "boolean",
+                "description": "false - тест, true - ПБК"
+            }
+        },
+        "required": [
+            "productItem",
+            "priceType",
+            "amount",
+            "dataBase"
+        ]
+    }
+}
+
+products_schema = {
+    "type": "array",
+    "items": {
+        "title": "Продукт",
+        "type": "object",
+        "properties": {
+            "item": {
+                "type": "string",
+                "minLength": 1,
+                "maxLength": 200,
+                "description": "Артикул продукта"
+            },
+            "name": {
+                "type": ["string", "null"],
+                "maxLength": 400
+            },
+            "description": {
+                "type": ["string", "null"],
+                "maxLength": 400
+            },
+            "active": {
+                "type": "boolean"
+            }
+        },
+        "required": [
+            "item"
+        ]
+    }
+}
+
+
+def compile_schema(schema):
+    # схема проверяется и валидатор собирается один раз при импорте, а не на каждый запрос
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+class ArrayValidator:
+    # потоковая проверка массива поэлементно: ошибки собираются вместе с индексами элементов,
+    # проверка прекращается, как только набрано max_errors ошибок
+    def __init__(self, schema):
+        self.validator = compile_schema(schema)
+        self.item_validator = compile_schema(schema['items'])
+
+    def errors(self, data, max_errors=None):
+        if max_errors is None:
+            max_errors = settings.SCHEMA_MAX_ERRORS
+        if not self.validator.is_type(data, 'array'):
+            return [{'index': None, 'path': '', 'message': 'Expected an array'}]
+        errors = []
+        for index, item in enumerate(data):
+            for error in self.item_validator.iter_errors(item):
+                errors.append({
+                    'index': index,
+                    'path': '/'.join(str(p) for p in error.absolute_path),
+                    'message': error.message
+                })
+                if max_errors and len(errors) >= max_errors:
+                    return errors
+        return errors
+
+
+clients_validator = ArrayValidator(clients_schema)
+visit_validator = compile_schema(visit_schema)
+checklistanswers_validator = ArrayValidator(checklistanswers_schema)
+prices_validator = ArrayValidator(prices_schema)
+products_validator = ArrayValidator(products_schema)
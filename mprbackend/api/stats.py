@@ -0,0 +1,162 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .bulk import chunks
+from .models import DataVersion, DeletedVisit, Order, OrderDailySummary, StaleSummaryDay, Visit, VisitDailySummary
+
+logger = logging.getLogger(__name__)
+
+# строка DataVersion с моментом начала последнего пересчета сводки, в микросекундах от начала эпохи
+WATERMARK = 'stats-refreshed'
+
+VISIT_METRICS = {
+    'visits': 'visits',
+    'payment': 'payment',
+    'paymentPlan': 'payment_plan',
+}
+
+ORDER_METRICS = {
+    'lines': 'lines',
+    'order': 'order',
+    'sales': 'sales',
+    'delivered': 'delivered',
+    'recommend': 'recommend',
+    'balance': 'balance',
+}
+
+# параметр groupBy -> (ключ в ответе, поле сводки)
+GROUPS = {
+    'manager': ('managerID', 'manager__userprofile__manager_ID'),
+    'client': ('clientINN', 'client_INN'),
+    'item': ('productItem', 'product_item'),
+}
+
+PERIODS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'total': None,
+}
+
+
+def dirty_days(since):
+    # дни, данные за которые менялись после since: измененные визиты и строки заказа, удаленные визиты
+    # и дни, с которых визиты перенесли на другую дату
+    days = set(Visit.objects.filter(last_modified__gte=since).values_list('date', flat=True).distinct())
+    days.update(Order.objects.filter(last_modified__gte=since).values_list('visit__date', flat=True).distinct())
+    days.update(DeletedVisit.objects.filter(deleted__gte=since).values_list('date', flat=True).distinct())
+    days.update(StaleSummaryDay.objects.values_list('date', flat=True))
+    days.discard(None)
+    return sorted(days)
+
+
+def summarize_days(days, refreshed):
+    VisitDailySummary.objects.filter(date__in=days).delete()
+    OrderDailySummary.objects.filter(date__in=days).delete()
+
+    visits = Visit.objects.filter(date__in=days).values('date', 'manager_id', 'client_INN').annotate(
+        count=Count('id'), payment_sum=Sum('payment'), payment_plan_sum=Sum('payment_plan')).order_by()
+    VisitDailySummary.objects.bulk_create([VisitDailySummary(
+        date=row['date'],
+        manager_id=row['manager_id'],
+        client_INN=row['client_INN'],
+        visits=row['count'],
+        payment=row['payment_sum'] or 0,
+        payment_plan=row['payment_plan_sum'] or 0,
+        refreshed=refreshed,
+    ) for row in visits])
+
+    orders = Order.objects.filter(visit__date__in=days).values(
+        'visit__date', 'visit__manager_id', 'visit__client_INN', 'product_item').annotate(
+        count=Count('id'), **{f + '_sum': Sum(f) for f in Order.DATA_FIELDS}).order_by()
+    OrderDailySummary.objects.bulk_create([OrderDailySummary(
+        date=row['visit__date'],
+        manager_id=row['visit__manager_id'],
+        client_INN=row['visit__client_INN'],
+        product_item=row['product_item'],
+        lines=row['count'],
+        refreshed=refreshed,
+        **{f: row[f + '_sum'] or 0 for f in Order.DATA_FIELDS}
+    ) for row in orders])
+
+
+def refresh(full=False):
+    # пересчитываются только дни, в которых что-то менялось с прошлого обновления. Отметка прошлого
+    # обновления хранится отдельной строкой (WATERMARK) и сдвигается, даже если пересчитывать было нечего,
+    # с тем же запасом на поздно закоммиченные транзакции, что и при дельта-синхронизации визитов.
+    # Возвращает количество пересчитанных дней
+    refreshed = timezone.now()
+    try:
+        with transaction.atomic():
+            watermark = None if full else DataVersion.get(WATERMARK)[0]
+            if not watermark:
+                days = set(Visit.objects.values_list('date', flat=True).distinct())
+                days.update(VisitDailySummary.objects.values_list('date', flat=True).distinct())
+                days.update(OrderDailySummary.objects.values_list('date', flat=True).distinct())
+                days.discard(None)
+                days = sorted(days)
+            else:
+                since = datetime.datetime.fromtimestamp(watermark / 10 ** 6, datetime.timezone.utc)
+                days = dirty_days(since - timezone.timedelta(seconds=settings.VISITS_SYNC_OVERLAP))
+            stale = list(StaleSummaryDay.objects.values_list('pk', flat=True))
+            for part in chunks(days):
+                summarize_days(part, refreshed)
+            StaleSummaryDay.objects.filter(pk__in=stale).delete()
+            DataVersion.objects.update_or_create(name=WATERMARK,
+                                                 defaults={'version': int(refreshed.timestamp() * 10 ** 6)})
+    except IntegrityError:
+        # те же дни параллельно пересчитал другой запрос
+        return 0
+    return len(days)
+
+
+def refresh_after_write():
+    # вызывается представлениями после записи визитов. Запись уже сохранена, поэтому ошибка пересчета
+    # (например, занятая другим писателем SQLite) не превращается в 500: отметка не сдвинулась, и эти дни
+    # пересчитает следующая запись или команда refreshstats
+    try:
+        refresh()
+    except DatabaseError:
+        logger.warning('Stats refresh failed, summary stays behind until the next refresh', exc_info=True)
+
+
+def query(group_by, period='day', date_from=None, date_to=None, manager=None):
+    # агрегаты по сводке: GROUP BY по выбранным полям и периоду. С разбивкой по артикулу доступны только
+    # показатели заказа, без нее к визитным показателям добавляются суммы заказа по всем артикулам
+    keys = [GROUPS[g] for g in group_by]
+    sources = [(OrderDailySummary, ORDER_METRICS)]
+    if 'item' not in group_by:
+        sources.insert(0, (VisitDailySummary, VISIT_METRICS))
+
+    defaults = {name: 0 for _, metrics in sources for name in metrics}
+    rows = {}
+    for model, metrics in sources:
+        q = model.objects.all()
+        if date_from:
+            q = q.filter(date__gte=date_from)
+        if date_to:
+            q = q.filter(date__lte=date_to)
+        if manager is not None:
+            q = q.filter(manager=manager)
+        fields = [field for _, field in keys]
+        if period == 'day':
+            fields.insert(0, 'date')
+        elif PERIODS[period]:
+            q = q.annotate(period=PERIODS[period]('date'))
+            fields.insert(0, 'period')
+        # имена агрегатов не должны совпадать с полями модели
+        q = q.values(*fields).annotate(**{'sum_' + name: Sum(field) for name, field in metrics.items()})
+        for row in q.order_by():
+            key = tuple(row[f] for f in fields)
+            if key not in rows:
+                rows[key] = dict({name: row[field] for name, field in keys}, **defaults)
+                if period != 'total':
+                    rows[key]['period'] = row[fields[0]]
+            rows[key].update({name: row['sum_' + name] for name in metrics})
+    return [rows[key] for key in sorted(rows, key=lambda k: [(v is None, str(v)) for v in k])]
@@ -1,3 +1,1034 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .asgi import ASGIHandler
+from .datagen import DataGenerator
+from .authentication import CachedTokenAuthentication, token_cache
+from .imaging import process_photo
+from .jobs import process_job
+from .metrics import registry
+from .models import (ChecklistAnswer, ChecklistQuestion, Client, DataVersion, ImportJob, Order, Photo, PhotoBlob,
+                     Price, Product, Visit, VisitDailySummary)
+from .stats import refresh as refresh_stats
+from .views import price_keyset, visit_keyset
+
+
+def make_user(username, role, manager_id=None):
+    user = User.objects.create_user(username=username, password='password')
+    user.userprofile.role = role
+    user.userprofile.manager_ID = manager_id
+    user.userprofile.save()
+    return user
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        self.office = make_user('office', 'OFFICE', 'office')
+        self.manager = make_user('manager', 'MPR', '1')
+        self.onec = make_user('onec', '1S', '1s')
+        self.client = APIClient()
+        self.client.force_authenticate(self.office)
+
+    def make_visits(self, count, orders=3):
+        for _ in range(count):
+            v = Visit.objects.create(
+                UUID=str(uuid.uuid4()),
+                date=timezone.now().date(),
+                client_INN='7700000000',
+                manager=self.manager,
+                author=self.office,
+                status=0)
+            for item in range(orders):
+                Order.objects.create(visit=v, product_item=str(item), order=item)
+
+
+class VisitsListTest(APITestCase):
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/visits')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_does_not_grow_with_visits(self):
+        self.make_visits(2)
+        few, data = self.count_queries()
+        self.assertEqual(len(data), 2)
+
+        self.make_visits(20)
+        many, data = self.count_queries()
+        self.assertEqual(len(data), 22)
+        self.assertEqual(few, many)
+
+    def test_visit_serialization(self):
+        self.make_visits(1, orders=2)
+        visit = self.client.get('/api/visits').json()[0]
+        self.assertEqual(visit['managerID'], '1')
+        self.assertEqual(visit['author'], 'office')
+        self.assertEqual(sorted(o['productItem'] for o in visit['orders']), ['0', '1'])
+
+
+class ClientsSyncTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.second = make_user('second', 'MPR', '2')
+        self.client.force_authenticate(self.onec)
+
+    def put(self, data):
+        response = self.client.put('/api/clients', data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_created_updated_unchanged(self):
+        data = [
+            {'inn': '1', 'name': 'Первый', 'manager': '1', 'authorizedManagersID': ['1', '2']},
+            {'inn': '2', 'name': 'Второй', 'delay': 5},
+        ]
+        self.assertEqual(self.put(data), {'created': 2, 'updated': 0, 'unchanged': 0})
+        first = Client.objects.get(INN='1')
+        self.assertEqual(first.manager, self.manager)
+        self.assertEqual(set(first.authorized_managers.all()), {self.manager, self.second})
+        self.assertEqual(Client.objects.get(INN='2').delay, 5)
+
+        self.assertEqual(self.put(data), {'created': 0, 'updated': 0, 'unchanged': 2})
+
+        data[0]['authorizedManagersID'] = ['2']
+        data[1]['delay'] = 7
+        data.append({'inn': '3', 'name': 'Третий'})
+        self.assertEqual(self.put(data), {'created': 1, 'updated': 2, 'unchanged': 0})
+        self.assertEqual(list(Client.objects.get(INN='1').authorized_managers.all()), [self.second])
+        self.assertEqual(Client.objects.get(INN='2').delay, 7)
+
+    def test_query_count_does_not_grow_with_clients(self):
+        def put_clients(count):
+            data = [{'inn': str(i), 'name': str(i), 'manager': '1', 'authorizedManagersID': ['1', '2']}
+                    for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                self.put(data)
+            return len(ctx.captured_queries)
+
+        DataVersion.objects.create(name='client')  # первая запись счетчика - лишние запросы
+        few = put_clients(3)
+        Client.objects.all().delete()
+        self.assertEqual(few, put_clients(30))
+
+    def test_unknown_manager(self):
+        response = self.client.put('/api/clients', [{'inn': '1', 'name': 'x', 'manager': 'nobody'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Client.objects.exists())
+
+
+@override_settings(VISITS_SYNC_OVERLAP=0)
+class VisitsDeltaSyncTest(APITestCase):
+    def sync(self, cursor):
+        response = self.client.get('/api/visits', {'since': cursor})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_only_changes_after_cursor(self):
+        self.make_visits(3)
+        first = self.sync('0')
+        self.assertEqual(len(first['visits']), 3)
+        self.assertEqual(first['deleted'], [])
+
+        self.assertEqual(self.sync(first['cursor'])['visits'], [])
+
+        changed, removed, untouched = Visit.objects.order_by('pk')
+        order = changed.order_set.first()
+        order.sales = 10
+        order.save()
+        removed.delete()
+
+        delta = self.sync(first['cursor'])
+        self.assertEqual([v['UUID'] for v in delta['visits']], [changed.UUID])
+        self.assertEqual(delta['deleted'], [removed.UUID])
+        last = self.sync(delta['cursor'])
+        self.assertEqual((last['visits'], last['deleted']), ([], []))
+
+    def test_reassigned_visit_is_deleted_for_old_owner(self):
+        other = make_user('manager2', 'MPR', '2')
+        self.make_visits(1)
+        old = self.client.get('/api/visits', {'since': '0', 'managerID': '1'}).json()
+        visit = Visit.objects.get()
+        visit.manager = other
+        visit.save()
+
+        delta = self.client.get('/api/visits', {'since': old['cursor'], 'managerID': '1'}).json()
+        self.assertEqual((delta['visits'], delta['deleted']), ([], [visit.UUID]))
+        delta = self.client.get('/api/visits', {'since': old['cursor'], 'managerID': '2'}).json()
+        self.assertEqual(([v['UUID'] for v in delta['visits']], delta['deleted']), ([visit.UUID], []))
+
+        # смена клиента - то же для выборки по старому ИНН
+        visit.client_INN = '7700000001'
+        visit.save()
+        delta = self.client.get('/api/visits', {'since': old['cursor'], 'clientINN': '7700000000'}).json()
+        self.assertEqual((delta['visits'], delta['deleted']), ([], [visit.UUID]))
+
+    def test_bulk_delete_writes_tombstones_in_bulk(self):
+        self.make_visits(5, orders=1)
+        uuids = sorted(Visit.objects.values_list('UUID', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/resetvisits')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "api_deletedvisit"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.sync('0')['deleted'], uuids)
+
+        # одиночное удаление по-прежнему оставляет след
+        self.make_visits(1)
+        visit = Visit.objects.get()
+        visit.delete()
+        self.assertIn(visit.UUID, self.sync('0')['deleted'])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/visits', {'since': 'yesterday'}).status_code, 400)
+
+
+class SchemaValidationTest(APITestCase):
+    def test_errors_reported_with_item_indexes(self):
+        data = [{'inn': '1'}, {'name': 'без ИНН'}, {'inn': '3', 'delay': -1}]
+        response = self.client.put('/api/clients', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(e['index'], e['path']) for e in response.json()], [(1, ''), (2, 'delay')])
+        self.assertFalse(Client.objects.exists())
+
+    @override_settings(SCHEMA_MAX_ERRORS=2)
+    def test_stops_after_error_limit(self):
+        response = self.client.put('/api/clients', [{'delay': 'x'}] * 100, format='json')
+        self.assertEqual(len(response.json()), 2)
+
+
+class ChecklistAnswersTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_visits(2)
+        self.visits = [v.UUID for v in Visit.objects.order_by('pk')]
+        self.questions = [str(ChecklistQuestion.objects.create(client_type='Хорека', text=str(i)).UUID)
+                          for i in range(3)]
+
+    def post(self, data):
+        return self.client.post('/api/checklistanswers', data, format='json')
+
+    def test_bulk_insert_and_upsert(self):
+        data = [{'visitUUID': v, 'questionUUID': q, 'answer1': True, 'answer2': 'x'}
+                for v in self.visits for q in self.questions]
+        self.assertEqual(self.post(data).status_code, 200)
+        self.assertEqual(ChecklistAnswer.objects.count(), 6)
+        visit = Visit.objects.get(UUID=self.visits[0])
+        self.assertEqual(len(visit.get_checklistanswer_order()), 3)
+
+        data[0]['answer2'] = 'исправлено'
+        self.assertEqual(self.post(data[:2]).status_code, 200)
+        self.assertEqual(ChecklistAnswer.objects.count(), 6)
+        self.assertEqual(ChecklistAnswer.objects.filter(answer2='исправлено').count(), 1)
+
+    def test_unknown_visit(self):
+        response = self.post([{'visitUUID': str(uuid.uuid4()), 'questionUUID': self.questions[0]}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ChecklistAnswer.objects.exists())
+
+
+class VisitOrdersUpdateTest(APITestCase):
+    def put(self, vuuid, orders):
+        data = {'clientINN': '7700000000', 'managerID': '1', 'orders': orders}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put('/api/visits/' + vuuid, data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def test_orders_written_in_bulk(self):
+        # запись визита пересчитывает сводку; первый пересчет - полный, его запросы сюда не относятся
+        refresh_stats()
+        vuuid = str(uuid.uuid4())
+        few = self.put(vuuid, [{'productItem': str(i), 'order': 1} for i in range(2)])
+        many = self.put(str(uuid.uuid4()), [{'productItem': str(i), 'order': 1} for i in range(50)])
+        self.assertEqual(few, many)
+
+        self.put(vuuid, [{'productItem': '0', 'order': 5}, {'productItem': '7', 'sales': 2}])
+        orders = {o.product_item: (o.order, o.sales) for o in Order.objects.filter(visit__UUID=vuuid)}
+        self.assertEqual(orders, {'0': (5, 0), '1': (1, 0), '7': (0, 2)})
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.manager)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/users/me')
+        return response, len(ctx.captured_queries)
+
+    def test_second_request_does_not_hit_database(self):
+        response, queries = self.get_me()
+        self.assertEqual(response.json()['ID'], '1')
+        self.assertEqual(queries, 1)
+        response, queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_requests_get_own_copies(self):
+        authenticate = CachedTokenAuthentication().authenticate_credentials
+        user, token = authenticate(self.token.key)
+        user.first_name = 'changed'
+        user.userprofile.role = 'OFFICE'
+        cached, cached_token = authenticate(self.token.key)
+        self.assertIsNot(cached, user)
+        self.assertIs(cached_token.user, cached)
+        self.assertEqual((cached.first_name, cached.userprofile.role), (self.manager.first_name, 'MPR'))
+
+    def test_profile_change_invalidates(self):
+        self.get_me()
+        self.manager.userprofile.manager_ID = '42'
+        self.manager.userprofile.save()
+        response, queries = self.get_me()
+        self.assertEqual(response.json()['ID'], '42')
+        self.assertEqual(queries, 1)
+
+    def test_token_deletion_invalidates(self):
+        self.get_me()
+        self.token.delete()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, 401)
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_visits(7, orders=1)
+        # несколько визитов без даты и на одну дату, чтобы проверить порядок по (date, id)
+        Visit.objects.filter(pk__in=Visit.objects.order_by('pk').values('pk')[:2]).update(date=None)
+        Visit.objects.filter(pk__in=Visit.objects.order_by('-pk').values('pk')[:2]).update(database=False)
+        self.expected = [v.UUID for v in Visit.objects.order_by('date', 'id')]
+
+    def test_keyset_pages_cover_all_rows_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'pageSize': 3}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.client.get('/api/visits', params).json()
+            seen.extend(v['UUID'] for v in page['results'])
+            cursor = page['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_keyset_pages_use_index_order(self):
+        # ORDER BY должен совпадать с индексом: временное B-дерево - это сортировка остатка на каждой странице
+        last = Visit.objects.order_by('date', 'id').last()
+        pages = [
+            visit_keyset.after(visit_keyset.order(Visit.objects.filter(manager=self.manager)), [last.date, 0]),
+            visit_keyset.after(visit_keyset.order(Visit.objects.filter(manager=self.manager)), [None, 0]),
+            price_keyset.after(price_keyset.order(Price.objects.all()), [1]),
+        ]
+        for q in pages:
+            sql, params = q[:3].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_stream(self):
+        response = self.client.get('/api/visits', {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([v['UUID'] for v in data], self.expected)
+        self.assertEqual(len(data[0]['orders']), 1)
+
+    def test_limit_is_applied_after_filters(self):
+        data = self.client.get('/api/visits', {'limit': 5, 'dataBase': 'false'}).json()
+        self.assertEqual(len(data), 2)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/visits', {'cursor': 'x'}).status_code, 400)
+
+    def test_bad_limit(self):
+        for params in ({'limit': -1}, {'limit': 0}, {'limit': 'x'}, {'pageSize': -1}):
+            self.assertEqual(self.client.get('/api/visits', params).status_code, 400)
+        # limit больше MAX_PAGE_SIZE урезается, как и pageSize, а не отклоняется
+        self.assertEqual(len(self.client.get('/api/visits', {'limit': 10001}).json()), len(self.expected))
+
+
+class PricesSyncTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.onec)
+
+    def put(self, data):
+        return self.client.put('/api/prices', data, format='json')
+
+    def test_counts_and_skipped_rows(self):
+        data = [{'productItem': str(i), 'priceType': t, 'amount': 100, 'dataBase': True}
+                for i in range(10) for t in ('1', '2')]
+        self.assertEqual(self.put(data).json(), {'created': 20, 'updated': 0, 'unchanged': 0})
+        data[0]['amount'] = '120'
+        data.append({'productItem': '0', 'priceType': '1', 'amount': '100', 'dataBase': False})
+        self.assertEqual(self.put(data).json(), {'created': 1, 'updated': 1, 'unchanged': 19})
+        self.assertEqual(Price.objects.get(product_item='0', price_type='1', database=True).amount, '120')
+
+    def test_invalid_payload_writes_nothing(self):
+        response = self.put([{'productItem': '1', 'priceType': '1', 'amount': '1', 'dataBase': True},
+                             {'productItem': '2', 'priceType': '1', 'amount': '1'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0]['index'], 1)
+        self.assertFalse(Price.objects.exists())
+
+    def test_too_long_fields_are_rejected(self):
+        # длиннее колонки в базе - ошибка схемы, а не DataError при записи
+        for field in ('productItem', 'priceType', 'amount'):
+            row = {'productItem': '1', 'priceType': '1', 'amount': '1', 'dataBase': True}
+            row[field] = 'x' * 201
+            self.assertEqual(self.put([row]).status_code, 400)
+        self.assertFalse(Price.objects.exists())
+
+
+class ProductsSyncTest(APITestCase):
+    def put(self, data):
+        return self.client.put('/api/products', data, format='json')
+
+    def test_field_level_diff(self):
+        data = [{'item': str(i), 'name': 'Товар %d' % i} for i in range(5)]
+        self.assertEqual(self.put(data).json(), {'created': 5, 'updated': 0, 'unchanged': 0})
+        data[1]['active'] = False
+        data[2]['description'] = 'Новое описание'
+        self.assertEqual(self.put(data).json(), {'created': 0, 'updated': 2, 'unchanged': 3})
+        self.assertFalse(Product.objects.get(item='1').active)
+        self.assertEqual(Product.objects.get(item='2').description, 'Новое описание')
+
+    def test_all_or_nothing_with_row_report(self):
+        response = self.put([{'item': 'ok'}, {'name': 'без артикула'}, {'item': 'x', 'active': 'yes'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['index'] for e in response.json()], [1, 2])
+        self.assertFalse(Product.objects.exists())
+
+
+class ConditionalGetTest(APITestCase):
+    def test_not_modified_until_data_changes(self):
+        self.client.put('/api/products', [{'item': '1', 'name': 'Товар'}], format='json')
+        response = self.client.get('/api/products')
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        self.client.put('/api/products', [{'item': '1', 'name': 'Другой товар'}], format='json')
+        response = self.client.get('/api/products', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_client_managers_change_etag(self):
+        client = Client.objects.create(name='Клиент', INN='1')
+        etag = self.client.get('/api/clients')['ETag']
+        client.authorized_managers.add(self.manager)
+        self.assertEqual(self.client.get('/api/clients', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_query(self):
+        self.assertNotEqual(self.client.get('/api/prices')['ETag'],
+                            self.client.get('/api/prices', {'DB': 'true'})['ETag'])
+
+
+class ClientVisibilityTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.second = make_user('second', 'MPR', '2')
+        for inn in range(3):
+            client = Client.objects.create(name=str(inn), INN=str(inn), manager=self.second)
+            client.authorized_managers.add(self.second)
+        Client.objects.get(INN='0').authorized_managers.add(self.manager)
+        Client.objects.create(name='свой', INN='10', manager=self.manager)
+
+    def visible(self, user):
+        self.client.force_authenticate(user)
+        return sorted(c['inn'] for c in self.client.get('/api/clients').json())
+
+    def test_visibility_follows_managers(self):
+        self.assertEqual(self.visible(self.manager), ['0', '10'])
+        self.assertEqual(self.visible(self.second), ['0', '1', '2'])
+
+        self.manager.authorized_managers.clear()
+        self.assertEqual(self.visible(self.manager), ['10'])
+
+        self.client.force_authenticate(self.onec)
+        self.client.put('/api/clients', [{'inn': '1', 'manager': '1', 'authorizedManagersID': []}], format='json')
+        self.assertEqual(self.visible(self.manager), ['1', '10'])
+        self.assertEqual(self.visible(self.second), ['0', '2'])
+
+    def test_query_count_does_not_grow_with_clients(self):
+        def count():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get('/api/clients')
+            return len(ctx.captured_queries)
+
+        self.client.force_authenticate(self.second)
+        few = count()
+        for inn in range(20, 40):
+            Client.objects.create(name=str(inn), INN=str(inn), manager=self.second).authorized_managers.add(
+                self.manager, self.second)
+        self.assertEqual(few, count())
+
+
+class ExportTest(APITestCase):
+    def content(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        self.make_visits(3, orders=2)
+        lines = self.content('/api/export/visits').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('id,UUID,date,'))
+        self.assertIn(',1,office,', lines[1])
+
+        lines = self.content('/api/export/orders').splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[0], 'visitID,visitUUID,productItem,order,delivered,recommend,balance,sales')
+
+    def test_columns_and_date_filter(self):
+        self.make_visits(2, orders=1)
+        batch = json.loads(self.content('/api/export/visits?output=columns'))
+        self.assertEqual(batch['rows'], 2)
+        self.assertEqual(batch['columns']['managerID'], ['1', '1'])
+        tomorrow = (timezone.now().date() + timezone.timedelta(days=1)).isoformat()
+        self.assertEqual(self.content('/api/export/orders?output=columns&dateFrom=' + tomorrow), '')
+
+    def test_bad_params_and_permissions(self):
+        self.assertEqual(self.client.get('/api/export/visits?output=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/export/visits?dateFrom=junk').status_code, 400)
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get('/api/export/visits').status_code, 403)
+
+    def test_command_rejects_bad_dates(self):
+        for value in ('junk', '2026-02-30', '18.10.2026'):
+            with self.assertRaises(CommandError):
+                call_command('exportvisits', '--date-from', value, '--output-dir', tempfile.gettempdir())
+
+
+class StatsTest(APITestCase):
+    def stats(self, query=''):
+        # визиты в тестах пишутся напрямую в модели, сводку догоняет тот же пересчет, что и refreshstats
+        refresh_stats()
+        response = self.client.get('/api/stats' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_aggregates(self):
+        self.make_visits(2, orders=3)
+        Visit.objects.update(payment=100, payment_plan=150)
+        rows = self.stats('?groupBy=manager,client&period=total')
+        self.assertEqual(rows, [{'managerID': '1', 'clientINN': '7700000000', 'visits': 2, 'payment': 200.0,
+                                 'paymentPlan': 300.0, 'lines': 6, 'order': 6, 'sales': 0, 'delivered': 0,
+                                 'recommend': 0, 'balance': 0}])
+        rows = self.stats('?groupBy=item&period=month')
+        self.assertEqual([(r['productItem'], r['order']) for r in rows], [('0', 0), ('1', 2), ('2', 4)])
+        self.assertNotIn('payment', rows[0])
+
+    @override_settings(VISITS_SYNC_OVERLAP=0)
+    def test_incremental_refresh(self):
+        self.make_visits(2, orders=1)
+        self.assertEqual(self.stats()[0]['visits'], 2)
+
+        # перенос визита на другой день пересчитывает и старый, и новый день
+        visit = Visit.objects.first()
+        visit.update_from_dict({'date': '2020-01-01', 'orders': [{'productItem': '0', 'order': 5}]})
+        rows = self.stats()
+        self.assertEqual([(r['period'], r['visits'], r['order']) for r in rows],
+                         [('2020-01-01', 1, 5), (str(timezone.now().date()), 1, 0)])
+        refreshed = VisitDailySummary.objects.get(date=timezone.now().date()).refreshed
+
+        # нетронутый день не пересчитывается
+        Visit.objects.get(pk=visit.pk).delete()
+        self.assertEqual(len(self.stats()), 1)
+        self.assertEqual(VisitDailySummary.objects.get().refreshed, refreshed)
+
+    def test_get_only_reads_summary(self):
+        self.make_visits(1, orders=0)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/stats').json(), [])
+        self.assertFalse([q for q in ctx.captured_queries if not q['sql'].startswith('SELECT')])
+
+        # запись визита через API пересчитывает сводку сразу
+        visit = Visit.objects.get()
+        self.assertEqual(self.client.put('/api/visits/' + visit.UUID, {'payment': 10}, format='json').status_code, 200)
+        self.assertEqual(self.client.get('/api/stats').json()[0]['visits'], 1)
+
+    @override_settings(VISITS_SYNC_OVERLAP=0)
+    def test_watermark_moves_without_summary_rows(self):
+        # пустая сводка и одни удаления не пересчитываются заново при каждом обновлении
+        self.assertEqual(refresh_stats(), 0)
+        self.make_visits(1, orders=0)
+        self.assertEqual(refresh_stats(), 1)
+        Visit.objects.get().delete()
+        self.assertEqual(refresh_stats(), 1)
+        self.assertFalse(VisitDailySummary.objects.exists())
+        self.assertEqual(refresh_stats(), 0)
+
+    def test_manager_sees_own_stats(self):
+        self.make_visits(1)
+        other = make_user('other', 'MPR', '2')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.stats(), [])
+        self.assertEqual(self.client.get('/api/stats?groupBy=foo').status_code, 400)
+
+
+class PhotoTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.make_visits(1, orders=0)
+        self.visit = Visit.objects.get()
+
+    def jpeg(self, size=(2000, 1000), orientation=None):
+        image = Image.new('RGB', size, 'red')
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def upload(self, content, name='photo.jpg'):
+        return self.client.post('/api/photos/' + self.visit.UUID,
+                                {'image': SimpleUploadedFile(name, content, 'image/jpeg')}, format='multipart')
+
+
+class PhotoProcessingTest(PhotoTestCase):
+    def test_variants(self):
+        content = self.jpeg(orientation=6)
+        self.assertEqual(self.upload(content).status_code, 200)
+        photo = Photo.objects.get()
+        self.assertIsNone(photo.processed)
+
+        process_photo(photo.pk)
+        photo.refresh_from_db()
+        self.assertEqual((photo.width, photo.height, photo.size), (1000, 2000, len(content)))
+        self.assertIsNotNone(photo.processed)
+        with Image.open(photo.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 320))
+            self.assertNotIn(0x0112, thumbnail.getexif())
+        with Image.open(photo.web.path) as web:
+            self.assertEqual(web.size, (800, 1600))
+
+
+class PhotoServingTest(PhotoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = self.jpeg()
+        self.upload(self.content)
+        self.photo = Photo.objects.get()
+        self.url = '/api/photos/%s/%d' % (self.visit.UUID, self.photo.pk)
+
+    def test_list(self):
+        photos = self.client.get('/api/photos/' + self.visit.UUID).json()
+        self.assertEqual(list(photos[0]['urls']), ['original'])
+        process_photo(self.photo.pk)
+        photos = self.client.get('/api/photos/' + self.visit.UUID).json()
+        self.assertEqual(photos[0]['size'], len(self.content))
+        self.assertTrue(photos[0]['urls']['thumbnail'].endswith(self.url + '?variant=thumbnail'))
+
+        self.client.force_authenticate(make_user('other', 'MPR', '2'))
+        self.assertEqual(self.client.get('/api/photos/' + self.visit.UUID).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_full_range_and_conditional(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='image/jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(self.content))
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=%d-' % len(self.content)).status_code, 416)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unready_variant_is_not_cached(self):
+        response = self.client.get(self.url + '?variant=thumbnail')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    @override_settings(PHOTO_ACCEL_REDIRECT='/protected-media/')
+    def test_accel_redirect(self):
+        process_photo(self.photo.pk)
+        self.photo.refresh_from_db()
+        response = self.client.get(self.url + '?variant=thumbnail')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.photo.thumbnail.name)
+        self.assertEqual(response.content, b'')
+
+
+class PhotoUploadTest(PhotoTestCase):
+    def put(self, upload, offset, chunk):
+        return self.client.put('/api/photos/%s/uploads/%s?offset=%d' % (self.visit.UUID, upload, offset), chunk,
+                               content_type='application/octet-stream')
+
+    def test_resumable_upload(self):
+        content = self.jpeg()
+        response = self.client.post('/api/photos/%s/uploads' % self.visit.UUID,
+                                    {'filename': '../photo.jpg', 'size': len(content)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        upload = response.json()['uploadID']
+        url = '/api/photos/%s/uploads/%s' % (self.visit.UUID, upload)
+
+        half = len(content) // 2
+        self.assertEqual(self.put(upload, 0, content[:half]).json()['offset'], half)
+        # повтор того же куска ничего не меняет, кусок с пропуском отклоняется
+        self.assertEqual(self.put(upload, 0, content[:half]).json()['offset'], half)
+        self.assertEqual(self.put(upload, half + 1, content[half + 1:]).status_code, 409)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(self.client.get(url).json()['offset'], half)
+
+        self.assertEqual(self.put(upload, half, content[half:]).json()['offset'], len(content))
+        photo_id = self.client.post(url).json()['photoID']
+        self.assertEqual(self.client.post(url).json()['photoID'], photo_id)
+
+        photo = Photo.objects.get(pk=photo_id)
+        self.assertEqual(photo.image.name, 'photos/blobs/%s/%s.jpg' % (photo.blob_id[:2], photo.blob_id))
+        with open(photo.image.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_bad_requests(self):
+        response = self.client.post('/api/photos/%s/uploads' % self.visit.UUID, {'size': 10}, format='json')
+        upload = response.json()['uploadID']
+        self.assertEqual(self.put(upload, 5, b'123456').status_code, 400)
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.put(upload, 0, b'1').status_code, 404)
+
+
+class PhotoDeduplicationTest(PhotoTestCase):
+    def test_same_content_is_stored_once(self):
+        content = self.jpeg()
+        self.upload(content)
+        process_photo(Photo.objects.get().pk)
+        # повтор в тот же визит не создает ни файла, ни строки
+        self.upload(content, name='retry.jpg')
+        self.assertEqual(Photo.objects.count(), 1)
+
+        other = Visit.objects.create(UUID=str(uuid.uuid4()), client_INN='1', manager=self.manager,
+                                     author=self.office)
+        self.visit = other
+        self.upload(content)
+        self.assertEqual(Photo.objects.count(), 2)
+        self.assertEqual(PhotoBlob.objects.count(), 1)
+        first, second = Photo.objects.order_by('pk')
+        self.assertEqual(first.image.name, second.image.name)
+        # варианты берутся у уже обработанной фотографии с тем же содержимым
+        self.assertEqual(second.thumbnail.name, first.thumbnail.name)
+        self.assertIsNotNone(second.processed)
+
+        self.upload(self.jpeg(size=(10, 10)))
+        self.assertEqual(PhotoBlob.objects.count(), 2)
+
+
+class DatabaseTuningTest(APITestCase):
+    def test_sqlite_pragmas_and_health(self):
+        response = self.client.get('/api/health')
+        self.assertEqual(response.status_code, 200)
+        database = response.json()['database']
+        self.assertEqual(database['engine'], 'sqlite')
+        # 1 - NORMAL
+        self.assertEqual(database['synchronous'], 1)
+        # из OPTIONS['timeout'] = 20 секунд
+        self.assertEqual(database['busy_timeout'], 20000)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/health').status_code, 200)
+
+
+class ASGIHandlerTest(TransactionTestCase):
+    # соединения потоков пула должны видеть данные теста, поэтому без обертки в транзакцию
+    def request(self, path, query=b'', token=None, method='GET', body=b'', root_path='', headers=None):
+        scope = {'type': 'http', 'method': method, 'path': root_path + path, 'root_path': root_path,
+                 'query_string': query, 'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')]}
+        if token:
+            scope['headers'].append((b'authorization', ('Token ' + token.key).encode()))
+        if body:
+            scope['headers'].append((b'content-length', str(len(body)).encode()))
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(ASGIHandler())(scope, receive, send)
+        if headers is not None:
+            headers.update((k.decode(), v.decode()) for k, v in messages[0]['headers'])
+        return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+    def test_plain_and_streaming_responses(self):
+        status_code, body = self.request('/api/health')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(body)['status'], 'ok')
+
+        token = Token.objects.create(user=make_user('office', 'OFFICE', 'office'))
+        manager = make_user('manager', 'MPR', '1')
+        for i in range(3):
+            Visit.objects.create(UUID=str(uuid.uuid4()), client_INN=str(i), manager=manager, author=manager)
+        # потоковый ответ читает курсор в потоке пула, а не в цикле событий
+        status_code, body = self.request('/api/visits', b'stream=true', token)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(sorted(v['clientINN'] for v in json.loads(body)), ['0', '1', '2'])
+
+    @override_settings(IMPORT_WORKERS=0)
+    def test_reverse_uses_script_prefix(self):
+        # reverse() в представлении выполняется в потоке пула и должен видеть SCRIPT_NAME приложения
+        token = Token.objects.create(user=make_user('onec', '1S', '1s'))
+        data = [{'productItem': '1', 'priceType': '1', 'amount': 100, 'dataBase': True}]
+        headers = {}
+        status_code, _ = self.request('/api/prices', b'async=true', token, method='PUT',
+                                      body=json.dumps(data).encode(), root_path='/mpr', headers=headers)
+        self.assertEqual(status_code, 202)
+        self.assertTrue(headers['Location'].startswith('http://testserver/mpr/api/imports/'), headers['Location'])
+
+
+class ImportJobTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.onec)
+
+    def test_prices_in_background(self):
+        data = [{'productItem': str(i), 'priceType': '1', 'amount': 100, 'dataBase': True} for i in range(10)]
+        response = self.client.put('/api/prices?async=true', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['status'], job['total']), ('queued', 10))
+        self.assertFalse(Price.objects.exists())
+        # повтор той же выгрузки, пока она в очереди, возвращает то же задание
+        self.assertEqual(self.client.put('/api/prices?async=true', data, format='json').json()['id'], job['id'])
+
+        process_job(job['id'])
+        job = self.client.get(response['Location']).json()
+        self.assertEqual((job['status'], job['processed']), ('done', 10))
+        self.assertEqual(job['result'], {'created': 10, 'updated': 0, 'unchanged': 0})
+        self.assertEqual(Price.objects.count(), 10)
+
+    def test_running_job_is_not_reused(self):
+        # задание, зависшее в running после падения процесса, не должно подменять новые повторы
+        data = [{'productItem': '1', 'priceType': '1', 'amount': 100, 'dataBase': True}]
+        job = self.client.put('/api/prices?async=true', data, format='json').json()
+        ImportJob.objects.filter(pk=job['id']).update(status='running')
+        retry = self.client.put('/api/prices?async=true', data, format='json').json()
+        self.assertNotEqual(retry['id'], job['id'])
+        self.assertEqual(retry['status'], 'queued')
+
+    @override_settings(IMPORT_CHUNK_SIZE=3)
+    def test_failed_job_keeps_applied_chunks_as_partial(self):
+        data = [{'inn': str(i), 'manager': '1', 'authorizedManagersID': []} for i in range(5)]
+        data.append({'inn': '99', 'manager': 'unknown', 'authorizedManagersID': []})
+        job = self.client.put('/api/clients?async=true', data, format='json').json()
+        process_job(job['id'])
+        job = self.client.get('/api/imports/' + job['id']).json()
+        self.assertEqual((job['status'], job['processed']), ('partial', 3))
+        self.assertEqual(job['result'], {'created': 3, 'updated': 0, 'unchanged': 0})
+        self.assertIn('unknown', job['error'])
+        self.assertEqual(Client.objects.count(), 3)
+
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get('/api/imports/' + job['id']).status_code, 403)
+
+    @override_settings(IMPORT_CHUNK_SIZE=3)
+    def test_failed_first_chunk_applies_nothing(self):
+        data = [{'inn': '99', 'manager': 'unknown', 'authorizedManagersID': []}]
+        data += [{'inn': str(i), 'manager': '1', 'authorizedManagersID': []} for i in range(5)]
+        job = self.client.put('/api/clients?async=true', data, format='json').json()
+        process_job(job['id'])
+        job = self.client.get('/api/imports/' + job['id']).json()
+        self.assertEqual((job['status'], job['processed']), ('failed', 0))
+        self.assertFalse(Client.objects.exists())
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_histograms_and_threshold_logging(self):
+        self.make_visits(2)
+        self.client.get('/api/visits')
+        self.client.get('/api/visits?stream=true').getvalue()
+        text = self.client.get('/api/metrics').content.decode()
+        labels = 'route="api/visits",method="GET",role="OFFICE"'
+        self.assertIn('mpr_request_duration_seconds_count{%s} 2' % labels, text)
+        self.assertIn('mpr_request_queries_bucket{%s,le="+Inf"} 2' % labels, text)
+        self.assertIn('mpr_response_bytes_count{%s} 2' % labels, text)
+
+        with override_settings(METRICS_MAX_QUERIES=0), self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/api/visits')
+        self.assertIn('route api/visits, role OFFICE', logs.output[0])
+
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+
+    def test_json_response_serialization_is_recorded_as_render(self):
+        # JSON-ответ любого представления, а не только списков
+        self.make_visits(2)
+        for path in ('/api/visits', '/api/visits?pageSize=1', '/api/users/me', '/api/health'):
+            self.client.get(path)
+        render = registry.histograms['render'].series
+        for route in (('api/visits', 'GET', 'OFFICE'), ('api/users/me', 'GET', 'OFFICE'),
+                      ('api/health', 'GET', 'OFFICE')):
+            self.assertGreater(render[route]['sum'], 0, route)
+        self.assertEqual(render[('api/visits', 'GET', 'OFFICE')]['count'], 2)
+
+
+class DataGeneratorTest(APITestCase):
+    def test_generated_data_is_reproducible_and_idempotent(self):
+        volumes = {'managers': 3, 'clients': 20, 'products': 10, 'questions': 4, 'visits': 60}
+        today = timezone.now().date()
+        first = DataGenerator(seed=7, batch_size=25, today=today).generate(**volumes)
+        self.assertEqual(first['visits'], 60)
+        self.assertEqual(first['orders'], Order.objects.count())
+        uuids = set(Visit.objects.values_list('UUID', flat=True))
+
+        again = DataGenerator(seed=7, batch_size=25, today=today).generate(**volumes)
+        self.assertEqual((again['visits'], again['orders'], again['answers']), (0, 0, 0))
+        self.assertEqual(set(Visit.objects.values_list('UUID', flat=True)), uuids)
+
+        # завершенные визиты с заказом видны менеджеру через API
+        manager = User.objects.get(username='gen-mpr-0')
+        self.client.force_authenticate(manager)
+        visits = self.client.get('/api/visits?status=2').json()
+        self.assertTrue(visits)
+        self.assertTrue(all(v['managerID'] == 'gen-mpr-0' and len(v['orders']) == 5 for v in visits))
+        self.assertTrue(self.client.get('/api/clients').json())
+
+    def test_prefixes_get_separate_clients(self):
+        volumes = {'managers': 2, 'clients': 5, 'products': 3, 'questions': 2, 'visits': 10}
+        DataGenerator(seed=1, prefix='one').generate(**volumes)
+        owners = dict(Client.objects.values_list('INN', 'manager__username'))
+        DataGenerator(seed=1, prefix='two').generate(**volumes)
+        self.assertEqual(Client.objects.count(), 10)
+        self.assertTrue(all(dict(Client.objects.values_list('INN', 'manager__username'))[inn] == username
+                            for inn, username in owners.items()))
+        # визиты каждого прогона - у клиентов своего менеджера
+        for visit in Visit.objects.all():
+            self.assertEqual(Client.objects.get(INN=visit.client_INN).manager_id, visit.manager_id)
+
+        # блок номеров занят чужими клиентами - генерация не подменяет их менеджеров
+        Client.objects.filter(manager__username__startswith='two-').update(manager=self.manager)
+        with self.assertRaises(ValueError):
+            DataGenerator(seed=1, prefix='two').generate(**volumes)
+
+    def test_resetvisits_bulk_inserts_demo_visits(self):
+        for inn in ('7700000001', '7700000002'):
+            Client.objects.create(INN=inn, name=inn, manager=self.manager)
+        Product.objects.create(item='a', name='a')
+        Product.objects.create(item='b', name='b')
+        Product.objects.create(item='c', name='c', active=False)
+        self.client.force_authenticate(self.manager)
+        refresh_stats()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/resetvisits').status_code, 200)
+        # вставка визитов - меньше 20 запросов, еще около десятка - пересчет сводки статистики
+        self.assertLess(len(ctx.captured_queries), 30)
+
+        finished = Visit.objects.filter(status=2)
+        self.assertEqual(finished.count(), 6)
+        self.assertGreaterEqual(Visit.objects.filter(status=0, date=timezone.now().date()).count(), 4)
+        self.assertEqual(set(Order.objects.values_list('product_item', flat=True)), {'a', 'b'})
+        self.assertEqual(Order.objects.count(), 12)
+        self.assertEqual(set(Visit.objects.values_list('author', flat=True)), {1})
+
+    def test_generatedata_endpoint(self):
+        response = self.client.post('/api/generatedata', {'managers': 2, 'clients': 5, 'products': 3, 'visits': 10},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['visits'], 10)
+        self.assertEqual(Visit.objects.count(), 10)
+        self.assertEqual(self.client.post('/api/generatedata', {'visits': -1}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/generatedata', [], format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/generatedata', {'managers': 0, 'visits': 10},
+                                          format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/generatedata', {'clients': 0, 'visits': 10},
+                                          format='json').status_code, 400)
+        with override_settings(GENERATE_DATA_MAX=dict(settings.GENERATE_DATA_MAX, visits=5, products=2)):
+            self.assertEqual(self.client.post('/api/generatedata', {'visits': 10}, format='json').status_code, 400)
+            self.assertEqual(self.client.post('/api/generatedata', {'products': 3}, format='json').status_code, 400)
+        with self.assertRaises(ValueError):
+            DataGenerator().generate(clients=10 ** 8 + 1)
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.post('/api/generatedata', {}, format='json').status_code, 403)
+
+
+class BenchLookupsTest(SimpleTestCase):
+    def test_runs_on_throwaway_database(self):
+        # команда запускается отдельным процессом: она сама создает и удаляет временную базу
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        configured = os.path.join(tmpdir, 'db.sqlite3')
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'benchlookups', '--visits', '200', '--products', '10', '--repeat', '1'],
+            cwd=settings.BASE_DIR, env=dict(os.environ, MPR_DB_ENGINE='sqlite', MPR_DB_NAME=configured),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('visit by UUID', result.stdout)
+        self.assertIn('USING INDEX', result.stdout)
+        self.assertFalse(os.path.exists(configured))
+
+
+class BenchTest(SimpleTestCase):
+    def bench(self, tmpdir, *args):
+        # как benchlookups - отдельным процессом на временной базе, с крошечными объемами
+        configured = os.path.join(tmpdir, 'db.sqlite3')
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'bench', '--managers', '2', '--clients', '10', '--products', '5',
+             '--questions', '2', '--visits', '40', '--requests', '2', '--baseline', os.path.join(tmpdir, 'base.json')]
+            + list(args),
+            cwd=settings.BASE_DIR, env=dict(os.environ, MPR_DB_ENGINE='sqlite', MPR_DB_NAME=configured),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertFalse(os.path.exists(configured))
+        return result
+
+    def test_saves_and_checks_baseline(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        result = self.bench(tmpdir, '--save-baseline')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('put clients 200', result.stdout)
+        with open(os.path.join(tmpdir, 'base.json')) as f:
+            baseline = json.load(f)
+        self.assertEqual(baseline['volumes']['visits'], 40)
+        self.assertTrue(all(r['queries'] > 0 for r in baseline['results'].values()))
+
+        # тот же прогон против своего эталона: число запросов детерминировано
+        result = self.bench(tmpdir, '--tolerance', '10')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('No regressions', result.stdout)
@@ -0,0 +1,115 @@
+import hashlib
+import os
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .files import BLOCK_SIZE
+from .imaging import schedule as schedule_photo
+from .models import Photo, PhotoBlob, PhotoUpload, blob_path
+
+
+class HashingUploadHandler(FileUploadHandler):
+    # считает SHA-256 файла по мере приема multipart-запроса, сами куски передает дальше
+    # стандартным обработчикам. Результат - request.upload_digests[имя поля]
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self.hash.hexdigest()
+        return None
+
+
+def file_digest(f):
+    f.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        digest.update(block)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def save_photo(visit, filename, digest, source, size):
+    # содержимое пишется на диск, только если такого хэша еще нет; иначе новая фотография - это одна строка
+    # в базе, а повтор загрузки в тот же визит возвращает уже существующую фотографию.
+    # source - путь временного файла (переносится без копирования) или загруженный файл
+    with transaction.atomic():
+        blob = PhotoBlob.objects.filter(digest=digest).first()
+        if blob is None:
+            name = blob_path(digest, filename)
+            if isinstance(source, str):
+                os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+                file_move_safe(source, default_storage.path(name), allow_overwrite=True)
+            else:
+                name = default_storage.save(name, source)
+            blob, created = PhotoBlob.objects.get_or_create(digest=digest, defaults={'file': name, 'size': size})
+        elif isinstance(source, str):
+            os.remove(source)
+
+        photo = Photo.objects.filter(visit=visit, blob=blob).first()
+        if photo is None:
+            photo = Photo.objects.create(visit=visit, blob=blob, image=blob.file.name)
+            schedule_photo(photo)
+    return photo
+
+
+def start_upload(visit, author, filename, size):
+    upload = PhotoUpload.objects.create(visit=visit, author=author, size=size,
+                                        filename=get_valid_filename(os.path.basename(filename)) or 'photo.jpg')
+    os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+    open(upload.path, 'wb').close()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length):
+    # кусок копируется из тела запроса прямо в файл по смещению, без буферизации всего тела.
+    # Повтор уже принятого куска пишет на то же место те же байты, поэтому безопасен; received
+    # только растет и обновляется одним UPDATE без блокировки строки на время передачи
+    written = 0
+    with open(upload.path, 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    if written == length:
+        PhotoUpload.objects.filter(pk=upload.pk, received__gte=offset).update(
+            received=Greatest(F('received'), offset + length), last_modified=timezone.now())
+    upload.refresh_from_db(fields=['received'])
+    return written == length
+
+
+def finish_upload(upload):
+    # временный файл переносится в хранилище переименованием, без копирования, или удаляется, если такое
+    # содержимое уже есть. Повторное завершение возвращает уже созданную фотографию
+    with transaction.atomic():
+        upload = PhotoUpload.objects.select_for_update().select_related('visit').get(pk=upload.pk)
+        if upload.photo_id:
+            return upload.photo
+        # куски могут приходить повторно и не по порядку, поэтому хэш считается по готовому файлу
+        with open(upload.path, 'rb') as f:
+            digest = file_digest(f)
+        upload.photo = save_photo(upload.visit, upload.filename, digest, upload.path, upload.size)
+        upload.save()
+    return upload.photo
+
+
+def discard_upload(upload):
+    if os.path.exists(upload.path):
+        os.remove(upload.path)
+    upload.delete()
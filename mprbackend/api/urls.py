@@ -9,12 +9,21 @@ urlpatterns = [
     path('visits', views.visits, name='visits'),
     path('resetvisits', views.resetvisits, name='resetvisits'),
     path('resetonesdata', views.resetonesdata, name='resetonesdata'),
+    path('generatedata', views.generatedata, name='generatedata'),
     path('visits/<uuid:vuuid>', views.visit, name='visit'),
     path('visits/id/<int:vid>', views.visitbyid),
     path('checklistsquestions', views.checklistsquestions, name='checklistsquestions'),
     path('checklistsquestions/<uuid:quuid>', views.checklistsquestions, name='checklistsquestions'),
     path('checklistanswers', views.checklistanswers, name='checklistanswers'),
     path('users/me', views.usersme, name='usersme'),
-    path('photos/<uuid:vuuid>', views.photos, name='photos')
+    path('photos/<uuid:vuuid>', views.photos, name='photos'),
+    path('photos/<uuid:vuuid>/<int:pid>', views.photofile, name='photofile'),
+    path('photos/<uuid:vuuid>/uploads', views.photouploads, name='photouploads'),
+    path('photos/<uuid:vuuid>/uploads/<uuid:upid>', views.photoupload, name='photoupload'),
+    path('export/visits', views.exports, {'table': 'visits'}, name='exportvisits'),
+    path('export/orders', views.exports, {'table': 'orders'}, name='exportorders'),
+    path('stats', views.stats, name='stats'),
+    path('health', views.health, name='health'),
+    path('imports/<uuid:juuid>', views.importjob, name='importjob'),
+    path('metrics', views.metrics, name='metrics')
 ]
-
@@ -1,262 +1,76 @@
+import hashlib
 import os
-import random
-import uuid
-import time
 
 import jsonschema
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.views.decorators.http import condition
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from .serializers import ChecklistQuestionSerializer, PriceSerializer, ProductSerializer
 from rest_framework.parsers import JSONParser
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.db import DatabaseError
 from django.db.models import Q
 
-from .models import Order, Visit, ChecklistQuestion, ChecklistAnswer, Client, Photo, Price, Product
+from .bulk import upsert_checklist_answers, upsert_clients, upsert_prices, upsert_products
+from .datagen import DataGenerator
+from .db import database_status
+from .export import FORMATS, export
+from .files import PassthroughRenderer, serve_file
+from .jobs import enqueue as enqueue_import
+from .metrics import JsonResponse, registry as metrics_registry
+from .models import (ChecklistAnswer, ChecklistQuestion, Client, DataVersion, DeletedVisit, ImportJob, Order, Photo,
+                     PhotoUpload, Price, Product, Visit)
+from .pagination import Keyset, list_response
+from .schemas import (checklistanswers_validator, clients_validator, prices_validator, products_validator,
+                      visit_validator)
+from .stats import GROUPS, PERIODS, query as stats_query, refresh_after_write as refresh_stats
+from .uploads import discard_upload, file_digest, finish_upload, save_photo, start_upload, write_chunk
 
 
 clients_path = os.path.join(settings.BASE_DIR, "static", "clients.json")
-clients_schema = {
-    "type": "array",
-    "items": {
-        "title": "Клиент",
-        "type": "object",
-        "description": "Данные клиента",
-        "x-examples": {},
-        "x-tags": [
-            "1С",
-            "Офис",
-            "Фронтенд"
-        ],
-        "properties": {
-            "name": {
-                "type": "string",
-                "description": "Наименование клиента для отображения пользователю"
-            },
-            "inn": {
-                "type": "string",
-                "description": "ИНН"
-            },
-            "clientType": {
-                "type": "string",
-                "description": "Тип клиента (хорека, драфт, магазин etc)"
-            },
-            "priceType": {
-                "type": "string",
-                "description": "Тип цен для клиента"
-            },
-            "delay": {
-                "type": "integer",
-                "default": 0,
-                "description": "Отсрочка по договору",
-                "format": "int32",
-                "example": 0,
-                "minimum": 0
-            },
-            "limit": {
-                "type": "integer",
-                "default": 0,
-                "description": "Лимит",
-                "format": "int64",
-                "example": 0,
-                "minimum": 0
-            },
-            "authorizedManagersID": {
-                "type": "array",
-                "description": "Массив ID менеджеров, для которых доступен клиент",
-                "items": {
-                    "type": "string"
-                }
-            },
-            "email": {
-                "type": "string",
-                "format": "email"
-            },
-            "phone": {
-                "type": "string"
-            },
-            "manager": {
-                "type": "string",
-                "description": "ID основного менеджера"
-            },
-            "longitude": {
-                "type": "string"
-            },
-            "latitude": {
-                "type": "string"
-            },
-            "status": {
-                "type": "boolean",
-                "default": "1",
-                "description": "Действует/не действует"
-            },
-            "dataBase": {
-                "type": "boolean",
-                "description": "false - тест, true - ПБК"
-            },
-            "address": {
-                "type": "string",
-                "description": "Адрес клиента"
-            }
-        },
-        "required": [
-            "inn"
-        ]
-    },
-}
-
-visit_schema = {
-    "title": "Визит",
-    "type": "object",
-    "description": "Данные по визитам",
-    "properties": {
-        "orders": {
-            "type": "array",
-            "description": "Массив данных о заказанных продуктах, остатке, продажах",
-            "items": {
-                "title": "Объект заказа",
-                "type": "object",
-                "description": "Объект описания заказанного, рекомендованного к заказу, остаточного и отгруженного "
-                               "товара",
-                "properties": {
-                    "productItem": {
-                        "type": "string",
-                        "description": "Артикул продукта. Генерируется приложением МПР, никогда не изменяется"
-                    },
-                    "order": {
-                        "type": "integer",
-                        "description": "Заказанное количество продукта. Генерируется приложением МПР, изменяется "
-                                       "приложением офиса "
-                    },
-                    "delivered": {
-                        "description": "Количество поставленного продукт. По умолчанию установлено в 0, обновляется "
-                                       "со стороны 1С",
-                        "type": "integer"
-                    },
-                    "recommend": {
-                        "type": "integer",
-                        "description": "Рекомендованное к заказу количесво. Генерируется приложением МПР и никогда не "
-                                       "изменяется "
-                    },
-                    "balance": {
-                        "description": "Остаток продукта у клиента. Генерируется приложением МПР, изменяется "
-                                       "приложением офиса",
-                        "type": "integer"
-                    },
-                    "sales": {
-                        "type": "integer",
-                        "description": "Продажи продкукта. Генерируется приложением МПР, изменяется приложением офиса"
-                    }
-                },
-                "required": [
-                    "productItem"
-                ]
-            }
-        },
-        "UUID": {
-            "type": "string",
-            "description": "Уникальный идентификатор визита. Генерируется приложением МПР или офиса и никогда не изменяется",
-            "format": "uuid"
-        },
-        "date": {
-            "type": "string",
-            "format": "date",
-            "description": "Дата совершения визита. Генерируется приложением МПР и никогда не изменяется"
-        },
-        "dataBase": {
-            "type": "boolean"
-        },
-        "clientINN": {
-            "type": "string",
-            "description": "ИНН клиента. Генерируется приложением МПР или офиса и никогда не изменяется"
-        },
-        "payment": {
-            "description": "Сумма денег, принятых в счет оплаты. Генерируется приложением МПР, обновляется приложением офиса",
-            "type": "integer"
-        },
-        "processed": {
-            "type": "string",
-            "description": "Номер накладной. Устанавливается в true со стороны 1С при создании накладной"
-        },
-        "invoice": {
-            "type": "string",
-            "description": "Номер ПКО. Устанавливается в true со стороны 1С при создании ПКО"
-        },
-        "status": {
-            "type": "integer",
-            "description": "Статус визита 0: не начат, 1: в работе, 2: завершен. Генерируется и обновляется приложениями МПР и офиса"
-        },
-        "managerID": {
-            "type": "string",
-            "description": "ID менеджера, который совершил (совершает) визит. Генерируется приложением МПР или офиса, никогда не изменяется"
-        },
-        "paymentPlan": {
-            "type": "integer"
-        },
-        "author": {
-            "type": "string",
-            "description": "ID автора визита"
-        },
-        "id": {
-            "type": "integer",
-            "description": "Человекочитаемый ID"
-        },
-        "deliveryDate": {
-            "type": "string",
-            "format": "date",
-            "description": "Дата доставки"
-        }
-    },
-}
-
-checklistanswers_schema = {
-    "type": "array",
-    "items":
-        {
-            "type": "object",
-            "properties": {
-                "questionUUID": {
-                    "type": "string",
-                    "description": "UUID вопроса",
-                    "format": "uuid"
-                },
-                "visitUUID": {
-                    "type": "string",
-                    "description": "UUID визита, в котором был дан ответ",
-                    "format": "uuid"
-                },
-                "answer1": {
-                    "type": [
-                        "string",
-                        "boolean"
-                    ],
-                    "description": "Ответ на вопрос/количество"
-                },
-                "answer2": {
-                    "type": "string",
-                    "description": "Примечание/цена"
-                },
-                "UUID": {
-                    "type": "string",
-                    "description": "UUID ответа",
-                    "format": "uuid"
-                }
-            },
-            "required": [
-                "questionUUID",
-                "visitUUID"
-            ]
-        }
-}
+
+# ключи сортировки для постраничной выдачи списков
+visit_keyset = Keyset(Visit, 'date', 'id')
+client_keyset = Keyset(Client, 'id')
+checklistanswer_keyset = Keyset(ChecklistAnswer, 'UUID')
+price_keyset = Keyset(Price, 'id')
+product_keyset = Keyset(Product, 'id')
+
+
+def reference_etag(*names):
+    # ETag справочных данных строится из счетчиков изменений таблиц, пользователя (от него зависит выборка,
+    # например клиенты МПР) и полного URL с параметрами - без выборки и сериализации самих данных
+    def etag(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        key = [names, DataVersion.get(*names), request.user.pk, request.get_full_path()]
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+    return etag
+
+
+def is_async(request):
+    # PUT ...?async=true - выгрузка обрабатывается в фоне, ответ 202 с заданием (api.jobs)
+    return request.query_params.get('async') in ('true', 'True')
+
+
+def import_accepted(request, job):
+    response = JsonResponse(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+    response['Location'] = request.build_absolute_uri(reverse('importjob', args=[job.pk]))
+    return response
 
 
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=reference_etag('product'))
 def products(request):
     if request.method == 'GET':
         productsQ = Product.objects.all()
@@ -264,27 +78,21 @@ def products(request):
         if active:
             active = True if (active == "true" or active == "True") else False
             productsQ = productsQ.filter(active=active)
-        serializer = ProductSerializer(productsQ, many=True)
-        return JsonResponse(serializer.data, safe=False)
+        return list_response(request, productsQ, product_keyset, lambda page: ProductSerializer(page, many=True).data)
     if request.method == 'PUT':
         if request.user.userprofile.role == 'MPR':
             return Response("Only 1S and office can do it", status=status.HTTP_403_FORBIDDEN)
-        data = JSONParser().parse(request)
-        for product in data:
-            try:
-                instance = Product.objects.get(item=product['item'])
-            except (KeyError, Product.DoesNotExist):
-                instance = None
-            serializer = ProductSerializer(instance=instance, data=product)
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        return Response('Ok', status=status.HTTP_200_OK)
+        errors = products_validator.errors(request.data, max_errors=0)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        if is_async(request):
+            return import_accepted(request, enqueue_import('products', request.data, request.user))
+        return Response(upsert_products(request.data), status=status.HTTP_200_OK)
 
 
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=reference_etag('price'))
 def prices(request):
     if request.method == 'GET':
         product_item = request.query_params.get('productItem', None)
@@ -300,26 +108,16 @@ def prices(request):
         if database:
             database = True if (database == "true" or database == "True") else False
             pricesQ = pricesQ.filter(database=database)
-        serializer = PriceSerializer(pricesQ, many=True)
-        return JsonResponse(serializer.data, safe=False)
+        return list_response(request, pricesQ, price_keyset, lambda page: PriceSerializer(page, many=True).data)
     if request.method == 'PUT':
         if request.user.userprofile.role != '1S':
             return Response("Only 1S can do it", status=status.HTTP_403_FORBIDDEN)
-        data = JSONParser().parse(request)
-        for price in data:
-            try:
-                instance = Price.objects.get(
-                    product_item=price['productItem'],
-                    price_type=price['priceType'],
-                    database=price['dataBase'])
-            except (KeyError, Price.DoesNotExist):
-                instance = None
-            serializer = PriceSerializer(instance=instance, data=price)
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        return Response('Ok', status=status.HTTP_200_OK)
+        errors = prices_validator.errors(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        if is_async(request):
+            return import_accepted(request, enqueue_import('prices', request.data, request.user))
+        return Response(upsert_prices(request.data), status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -359,6 +157,7 @@ def usersme(request):
 
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=reference_etag('client', 'userprofile'))
 def clients(request):
     if request.method == 'GET':
         q = Client.objects.all()
@@ -385,35 +184,40 @@ def clients(request):
         if price_type:
             q = q.filter(price_type=price_type)
         if manager:
-            q = q.filter(Q(authorized_managers=manager) | Q(manager=manager)).distinct()
+            q = q.visible_to(manager)
         if client_status:
             client_status = True if (client_status == "true" or client_status == "True") else False
             q = q.filter(status=client_status)
 
-        result = [c.to_dict() for c in q]
-        return JsonResponse(result, safe=False, status=status.HTTP_200_OK)
+        return list_response(request, q.with_related(), client_keyset, lambda page: [c.to_dict() for c in page])
 
     elif request.method == 'PUT':
         if request.user.userprofile.role == 'MPR':
             return Response("You can't do that", status=status.HTTP_403_FORBIDDEN)
         else:
+            errors = clients_validator.errors(request.data)
+            if errors:
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            if is_async(request):
+                return import_accepted(request, enqueue_import('clients', request.data, request.user))
             try:
-                jsonschema.validate(instance=request.data, schema=clients_schema)
-            except jsonschema.exceptions.ValidationError as e:
-                print(e)
+                result = upsert_clients(request.data)
+            except User.DoesNotExist as e:
                 return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
-            for c in request.data:
-                try:
-                    client = Client.objects.get(INN=c['inn'])
-                except Client.DoesNotExist:
-                    client = Client.objects.create(name=c['name'], INN=c['inn'])
-                client.update_from_dict(c)
-
-            return Response('Client list have been putted', status=status.HTTP_200_OK)
+            return Response(result, status=status.HTTP_200_OK)
     else:
         return Response('Method not allowed', status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+def make_cursor(moment):
+    # курсор дельта-синхронизации визитов: время на сервере в микросекундах от начала эпохи
+    return str(int(moment.timestamp() * 1000000))
+
+
+def parse_cursor(cursor):
+    return timezone.datetime.fromtimestamp(int(cursor) / 1000000, tz=timezone.utc)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def visits(request):
@@ -444,13 +248,15 @@ def visits(request):
         visit_status = request.query_params.get('status', None)
         client_inn = request.query_params.get('clientINN', None)
         date = request.query_params.get('date', None)
-        limit = request.query_params.get('limit', None)
         database = request.query_params.get('dataBase', None)
-        if limit:
+        since = request.query_params.get('since', None)
+        if since:
+            # курсор фиксируем до выборки, чтобы изменения, сделанные во время запроса, попали в следующую
+            cursor = make_cursor(timezone.now())
             try:
-                limit = int(limit)
-            except ValueError:
-                return Response("Bad limit value", status=status.HTTP_400_BAD_REQUEST)
+                since = parse_cursor(since) - timezone.timedelta(seconds=settings.VISITS_SYNC_OVERLAP)
+            except (ValueError, OverflowError, OSError):
+                return Response("Bad since value", status=status.HTTP_400_BAD_REQUEST)
         # делаем последовательную фильтрацию
         # потому что https://docs.djangoproject.com/en/3.0/topics/db/queries/#querysets-are-lazy
         # и это ничего не стоит
@@ -477,13 +283,27 @@ def visits(request):
             q = q.filter(client_INN=client_inn)
         if date:
             q = q.filter(date__gte=date)
-        if limit:
-            q = q[:limit]
+        if since:
+            # визит изменился сам или изменилась хотя бы одна строка его заказа
+            q = q.filter(Q(last_modified__gte=since)
+                         | Q(pk__in=Order.objects.filter(last_modified__gte=since).values('visit_id')))
         if database:
             database = True if (database == "true" or database == "True") else False
             q = q.filter(database=database)
-        result = [v.to_dict() for v in q]
-        return JsonResponse(result, safe=False, status=status.HTTP_200_OK)
+        q = q.with_related()
+        if since:
+            result = [v.to_dict() for v in q]
+            deleted = DeletedVisit.objects.filter(deleted__gte=since)
+            if manager:
+                deleted = deleted.filter(manager=manager)
+            if client_inn:
+                deleted = deleted.filter(client_INN=client_inn)
+            # визит мог быть удален и создан заново с тем же UUID
+            present = {v['UUID'] for v in result}
+            deleted = {d for d in deleted.values_list('UUID', flat=True) if d not in present}
+            return JsonResponse({'visits': result, 'deleted': sorted(deleted), 'cursor': cursor},
+                                status=status.HTTP_200_OK)
+        return list_response(request, q, visit_keyset, lambda page: [v.to_dict() for v in page])
     return Response({}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
@@ -492,7 +312,7 @@ def visits(request):
 def visit(request, vuuid):
     if request.method == 'GET':
         try:
-            v = Visit.objects.get(UUID=vuuid)
+            v = Visit.objects.with_related().get(UUID=vuuid)
         except Visit.DoesNotExist:
             return Response("Visit not found", status=status.HTTP_404_NOT_FOUND)
         if request.user.userprofile.role == 'MPR':
@@ -533,7 +353,7 @@ def visit(request, vuuid):
                 or request.user.userprofile.role == 'OFFICE' \
                 or request.user.userprofile.role == '1S':
             try:
-                jsonschema.validate(instance=request.data, schema=visit_schema)
+                visit_validator.validate(request.data)
                 v.update_from_dict(request.data)
             except jsonschema.exceptions.ValidationError as e:
                 print(e.message)
@@ -541,6 +361,7 @@ def visit(request, vuuid):
             except User.DoesNotExist:
                 return Response("Can't update visit: there is no manager with such ID, please try with another",
                                 status=status.HTTP_400_BAD_REQUEST)
+            refresh_stats()
             return JsonResponse(v.to_dict(), status=status.HTTP_200_OK)
         else:
             return Response("You don't have permissions to put visit", status=status.HTTP_403_FORBIDDEN)
@@ -552,6 +373,7 @@ def visit(request, vuuid):
             return Response("Visit not found", status=status.HTTP_404_NOT_FOUND)
         if request.user.userprofile.role == 'OFFICE':
             v.delete()
+            refresh_stats()
             return Response("Visit have been deleted", status=status.HTTP_204_NO_CONTENT)
         else:
             return Response("You don't have permissions to delete visit", status=status.HTTP_403_FORBIDDEN)
@@ -574,70 +396,24 @@ def resetvisits(request):
     if request.user.userprofile.role == 'MPR':
         # Visit.objects.filter(
         #     manager=User.objects.get(userprofile__manager_ID=request.user.userprofile.manager_ID)).delete()
-        date = timezone.now().date()
         q = Client.objects.filter(manager=request.user)
         q = q.exclude(client_type='Магазин')
         clientsinn = q.values_list('INN', flat=True)
         if not clientsinn:
             return Response("There are no clients for this manager found", status=status.HTTP_200_OK)
 
-        for _ in range(random.randint(4, 8)):  # запланированные на сегодня визиты
-            clientinn = random.choice(clientsinn)
-            Visit.objects.create(
-                UUID=uuid.uuid4(),
-                author=User.objects.get(pk=1),
-                manager=request.user,
-                client_INN=clientinn,
-                status=0,
-                date=date,
-                payment_plan=random.randint(2000, 10000))
-
-        for _ in range(random.randint(10, 16)):  # запланированные на неделю визиты
-            for days in range(1, 5):
-                clientinn = random.choice(clientsinn)
-                Visit.objects.create(
-                    UUID=uuid.uuid4(),
-                    author=User.objects.get(pk=1),
-                    manager=request.user,
-                    client_INN=clientinn,
-                    status=0,
-                    date=date + timezone.timedelta(days=days),
-                    payment_plan=random.randint(2000, 10000))
-
-        pr = Client.objects.all().filter(active=True)
-
-        for clientinn in clientsinn:  # делаем по три оконченных визита для каждого клиента
-            for delta in range(3):
-                payment = random.randint(2000, 10000)
-                v = Visit.objects.create(
-                    UUID=uuid.uuid4(),
-                    manager=request.user,
-                    client_INN=clientinn,
-                    status=2,
-                    date=date - timezone.timedelta(days=(14 * (delta + 1) + random.randint(0, 5))),
-                    delivery_date=date + timezone.timedelta(days=random.randint(6, 14)),
-                    payment=payment,
-                    payment_plan=payment - random.randint(0, 2000),
-                    author=User.objects.get(pk=1)
-                )
-
-                for product in pr:
-                    order = random.randint(3, 15)
-                    Order.objects.create(
-                        visit=v,
-                        product_item=product['item'],
-                        order=order,
-                        delivered=0,
-                        recommend=random.choice([order, order - 1, order - 2]),
-                        balance=random.randint(0, 10),
-                        sales=random.randint(0, 15)
-                    )
+        # автор демонстрационных визитов - администратор
+        author = User.objects.get(pk=1)
+        items = list(Product.objects.filter(active=True).values_list('item', flat=True))
+        DataGenerator(seed=None).manager_visits(request.user.pk, author.pk, list(clientsinn), items)
+        refresh_stats()
 
         return Response("New visits have been added for" + str(clientsinn), status=status.HTTP_200_OK)
 
     else:
         Photo.objects.all().delete()
         Visit.objects.all().delete()
+        refresh_stats()
         return Response("All visits and photos have been deleted", status=status.HTTP_200_OK)
 
 
@@ -650,8 +426,36 @@ def resetonesdata(request):
     return Response("All clients, products, prices have been deleted", status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def generatedata(request):
+    if request.user.userprofile.role == 'MPR':
+        return Response("You can't do that", status=status.HTTP_403_FORBIDDEN)
+    volumes = {'managers': 10, 'clients': 1000, 'products': 500, 'questions': 20, 'visits': 10000, 'orders': 5,
+               'answers': 3}
+    params = dict(volumes, seed=0)
+    if not isinstance(request.data, dict):
+        return Response("Expected an object with volumes", status=status.HTTP_400_BAD_REQUEST)
+    for name, value in request.data.items():
+        if name not in params or not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            return Response("Bad value for " + name, status=status.HTTP_400_BAD_REQUEST)
+        params[name] = value
+    for name, limit in settings.GENERATE_DATA_MAX.items():
+        if params[name] > limit:
+            return Response("Too many %s for a request (at most %d), use manage.py generatedata" % (name, limit),
+                            status=status.HTTP_400_BAD_REQUEST)
+    generator = DataGenerator(seed=params.pop('seed'))
+    try:
+        result = generator.generate(**params)
+    except ValueError as e:
+        return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+    refresh_stats()
+    return Response(result, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=reference_etag('checklistquestion'))
 def checklistsquestions(request, quuid=None):
     if request.method == 'GET':
         if quuid:
@@ -687,7 +491,7 @@ def checklistsquestions(request, quuid=None):
 @permission_classes([IsAuthenticated])
 def checklistanswers(request):
     if request.method == 'GET':
-        q = ChecklistAnswer.objects.all()
+        q = ChecklistAnswer.objects.select_related('visit')
 
         client_type = request.query_params.get('clientType', None)
         visitUUID = request.query_params.get('visit', None)
@@ -714,52 +518,136 @@ def checklistanswers(request):
                 return Response('Bad checklist question UUID', status=status.HTTP_400_BAD_REQUEST)
             q = q.filter(question=question)
 
-        result = [a.to_dict() for a in q]
-        return JsonResponse(result, safe=False, status=status.HTTP_200_OK)
+        return list_response(request, q, checklistanswer_keyset, lambda page: [a.to_dict() for a in page])
 
     if request.method == 'POST':
-        time.sleep(1)
+        errors = checklistanswers_validator.errors(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
         try:
-            jsonschema.validate(instance=request.data, schema=checklistanswers_schema)
-        except jsonschema.exceptions.ValidationError as e:
+            upsert_checklist_answers(request.data)
+        except (Visit.DoesNotExist, ChecklistQuestion.DoesNotExist) as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
-        for answer in request.data:
-            try:
-                v = Visit.objects.get(UUID=answer['visitUUID'])
-            except (KeyError, Visit.DoesNotExist):
-                return Response('Something wrong with visit UUID', status=status.HTTP_400_BAD_REQUEST)
-            try:
-                q = ChecklistQuestion.objects.get(UUID=answer['questionUUID'])
-            except (KeyError, ChecklistQuestion.DoesNotExist):
-                return Response('Something wrong with question UUID', status=status.HTTP_400_BAD_REQUEST)
-            try:
-                ChecklistAnswer.objects.create(
-                    # UUID=answer['UUID'],
-                    question=q,
-                    visit=v,
-                    answer1=str(answer.get('answer1', '')),
-                    answer2=answer.get('answer2', '')
-                )
-            except Exception:
-                return Response('Something wrong with answer creation', status=status.HTTP_400_BAD_REQUEST)
         return Response('OK', status=status.HTTP_200_OK)
 
 
+def photo_to_dict(request, photo):
+    url = request.build_absolute_uri(reverse('photofile', args=[photo.visit.UUID, photo.pk]))
+    result = {
+        'id': photo.pk,
+        'timestamp': photo.timestamp,
+        'urls': {'original': url}
+    }
+    if photo.processed:
+        result.update({'width': photo.width, 'height': photo.height, 'size': photo.size})
+        for variant in settings.PHOTO_VARIANTS:
+            result['urls'][variant] = url + '?variant=' + variant
+    return result
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def photos(request, vuuid):
+    try:
+        cvisit = Visit.objects.get(UUID=vuuid)
+    except Visit.DoesNotExist:
+        return Response('Visit not found', status=status.HTTP_400_BAD_REQUEST)
     if request.method == 'POST':
         try:
-            cvisit = Visit.objects.get(UUID=vuuid)
-        except Visit.DoesNotExist:
-            return Response('Visit not found', status=status.HTTP_400_BAD_REQUEST)
-        try:
-            Photo.objects.create(visit=cvisit, image=request.data['image'])
-        except KeyError:
+            image = request.data['image']
+            digest = getattr(request, 'upload_digests', {}).get('image') or file_digest(image)
+        except (KeyError, AttributeError):
             return Response('Bad image content', status=status.HTTP_400_BAD_REQUEST)
+        # уменьшенные копии готовятся в фоне, ответ уходит сразу после записи файла
+        save_photo(cvisit, image.name, digest, image, image.size)
         return Response('Photo have been saved', status=status.HTTP_200_OK)
     if request.method == 'GET':
-        return Response('Not implemented yet', status=status.HTTP_501_NOT_IMPLEMENTED)
+        if request.user.userprofile.role == 'MPR' and cvisit.manager_id != request.user.pk:
+            return Response('Visit not found', status=status.HTTP_400_BAD_REQUEST)
+        q = Photo.objects.filter(visit=cvisit).select_related('visit').order_by('timestamp', 'pk')
+        return JsonResponse([photo_to_dict(request, p) for p in q], safe=False, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([JSONRenderer, PassthroughRenderer])
+def photofile(request, vuuid, pid):
+    # байты оригинала или варианта (?variant=thumbnail|web)
+    try:
+        photo = Photo.objects.select_related('visit').get(pk=pid, visit__UUID=vuuid)
+    except Photo.DoesNotExist:
+        return Response('Photo not found', status=status.HTTP_404_NOT_FOUND)
+    if request.user.userprofile.role == 'MPR' and photo.visit.manager_id != request.user.pk:
+        return Response('Photo not found', status=status.HTTP_404_NOT_FOUND)
+    variant = request.query_params.get('variant', 'original')
+    if variant != 'original' and variant not in settings.PHOTO_VARIANTS:
+        return Response('Bad variant value', status=status.HTTP_400_BAD_REQUEST)
+    field_file = photo.image if variant == 'original' else getattr(photo, variant)
+    if not field_file:
+        # вариант еще не готов - отдаем оригинал, но без кэширования
+        return serve_file(request, photo.image, cache=False)
+    return serve_file(request, field_file)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def photouploads(request, vuuid):
+    # начало загрузки частями: {"filename": "...", "size": байт}
+    try:
+        cvisit = Visit.objects.get(UUID=vuuid)
+    except Visit.DoesNotExist:
+        return Response('Visit not found', status=status.HTTP_400_BAD_REQUEST)
+    try:
+        size = int(request.data['size'])
+        filename = str(request.data.get('filename', ''))
+    except (KeyError, TypeError, ValueError):
+        return Response('Bad size value', status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < size <= settings.PHOTO_UPLOAD_MAX_SIZE:
+        return Response('Bad size value', status=status.HTTP_400_BAD_REQUEST)
+    upload = start_upload(cvisit, request.user, filename, size)
+    return JsonResponse(upload.to_dict(), status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT', 'POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def photoupload(request, vuuid, upid):
+    # GET - сколько байт уже принято (откуда продолжать), PUT ?offset=N - очередной кусок в теле
+    # запроса как есть (application/octet-stream), POST - завершение, DELETE - отмена
+    try:
+        upload = PhotoUpload.objects.get(pk=upid, visit__UUID=vuuid, author=request.user)
+    except PhotoUpload.DoesNotExist:
+        return Response('Upload not found', status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'PUT':
+        if upload.photo_id:
+            return JsonResponse(upload.to_dict(), status=status.HTTP_200_OK)
+        try:
+            offset = int(request.query_params['offset'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return Response('Bad offset or Content-Length value', status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or length < 0 or offset + length > upload.size:
+            return Response('Bad offset or Content-Length value', status=status.HTTP_400_BAD_REQUEST)
+        if offset > upload.received:
+            # пропущен предыдущий кусок: клиент продолжает с offset из ответа
+            return JsonResponse(upload.to_dict(), status=status.HTTP_409_CONFLICT)
+        # тело читается из request.stream напрямую, request.data не трогаем
+        if not write_chunk(upload, offset, request.stream, length):
+            return JsonResponse(upload.to_dict(), status=status.HTTP_400_BAD_REQUEST)
+
+    if request.method == 'POST':
+        if upload.received < upload.size:
+            return JsonResponse(upload.to_dict(), status=status.HTTP_409_CONFLICT)
+        finish_upload(upload)
+        upload.refresh_from_db()
+
+    if request.method == 'DELETE':
+        if upload.photo_id:
+            return Response('Upload is finished', status=status.HTTP_400_BAD_REQUEST)
+        discard_upload(upload)
+        return Response('Upload have been deleted', status=status.HTTP_200_OK)
+
+    return JsonResponse(upload.to_dict(), status=status.HTTP_200_OK)
 
 
 @api_view(['GET', 'PUT'])
@@ -769,3 +657,85 @@ def tasks(request, tuuid):
         return Response('', status=status.HTTP_501_NOT_IMPLEMENTED)
     if request.method == 'PUT':
         return Response('', status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
+def date_range(request):
+    # dateFrom и dateTo в формате ГГГГ-ММ-ДД, оба необязательные
+    dates = []
+    for name in ('dateFrom', 'dateTo'):
+        value = request.query_params.get(name, None)
+        parsed = parse_date(value) if value else None
+        if value and not parsed:
+            raise ValueError(value)
+        dates.append(parsed)
+    return dates
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exports(request, table):
+    if request.user.userprofile.role == 'MPR':
+        return Response("Only 1S and office can do it", status=status.HTTP_403_FORBIDDEN)
+    export_format = request.query_params.get('output', 'csv')
+    if export_format not in FORMATS:
+        return Response("Bad output value", status=status.HTTP_400_BAD_REQUEST)
+    try:
+        dates = date_range(request)
+    except ValueError:
+        return Response("Bad dateFrom or dateTo value", status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(export(table, export_format, *dates),
+                                     content_type=FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        table, 'csv' if export_format == 'csv' else 'ndjson')
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def stats(request):
+    # агрегаты по визитам и заказам из сводки, без выгрузки визитов на клиент.
+    # groupBy - через запятую из manager, client, item; period - day, week, month или total
+    group_by = [g for g in request.query_params.get('groupBy', 'manager').split(',') if g]
+    period = request.query_params.get('period', 'day')
+    if any(g not in GROUPS for g in group_by) or period not in PERIODS:
+        return Response("Bad groupBy or period value", status=status.HTTP_400_BAD_REQUEST)
+    try:
+        date_from, date_to = date_range(request)
+    except ValueError:
+        return Response("Bad dateFrom or dateTo value", status=status.HTTP_400_BAD_REQUEST)
+    # сводку пересчитывают записи визитов (refresh_stats) и команда refreshstats: GET только читает
+    manager = request.user if request.user.userprofile.role == 'MPR' else None
+    return JsonResponse(stats_query(group_by, period, date_from, date_to, manager), safe=False,
+                        status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def health(request):
+    # проверка для балансировщика и мониторинга, без авторизации
+    try:
+        database = database_status()
+    except DatabaseError as e:
+        return JsonResponse({'status': 'error', 'database': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JsonResponse({'status': 'ok', 'database': database}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def importjob(request, juuid):
+    if request.user.userprofile.role == 'MPR':
+        return Response("Only 1S and office can do it", status=status.HTTP_403_FORBIDDEN)
+    try:
+        job = ImportJob.objects.get(pk=juuid)
+    except ImportJob.DoesNotExist:
+        return Response('Job not found', status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(job.to_dict(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def metrics(request):
+    # гистограммы запросов этого процесса в текстовом формате Prometheus
+    if request.user.userprofile.role != 'OFFICE':
+        return Response("Only office can do it", status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
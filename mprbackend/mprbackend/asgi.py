@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mprbackend.settings')
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+# обработчик с пулом потоков для представлений вместо стандартного (см. api.asgi), например:
+# uvicorn mprbackend.asgi:application --workers 2
+from api.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
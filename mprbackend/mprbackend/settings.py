@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -78,13 +81,47 @@ WSGI_APPLICATION = 'mprbackend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# база выбирается переменными окружения: MPR_DB_ENGINE=sqlite (по умолчанию) или postgresql.
+# CONN_MAX_AGE - сколько секунд соединение переиспользуется между запросами (0 - новое на каждый запрос)
+DB_ENGINE = os.environ.get('MPR_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('MPR_DB_NAME', 'mprbackend'),
+            'USER': os.environ.get('MPR_DB_USER', 'mprbackend'),
+            'PASSWORD': os.environ.get('MPR_DB_PASSWORD', ''),
+            'HOST': os.environ.get('MPR_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('MPR_DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('MPR_DB_CONN_MAX_AGE', 60)),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('MPR_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('MPR_DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # сколько секунд ждать снятия блокировки записи, прежде чем вернуть "database is locked".
+                # Единственная настройка ожидания: sqlite3 сам выставляет по ней PRAGMA busy_timeout
+                'timeout': 20,
+            },
+        }
     }
+
+# PRAGMA для каждого нового соединения SQLite (api.db): WAL - читатели не ждут писателя и наоборот,
+# synchronous=NORMAL - в режиме WAL надежно и без fsync на каждый коммит, mmap - чтение без копирования
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
 }
 
+# проверять переиспользуемое соединение в начале запроса и закрывать его, если база его оборвала
+DB_HEALTH_CHECKS = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -129,14 +166,83 @@ STATICFILES_DIRS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
 
+# кэш токенов в памяти процесса (api.authentication.CachedTokenAuthentication): количество записей
+# и время жизни записи в секундах. Изменение или удаление токена, пользователя или профиля сбрасывает кэш
+# только в том процессе, где оно сделано: другие процессы (воркеры gunicorn, uwsgi) еще до TOKEN_CACHE_TTL
+# секунд пускают по удаленному токену и видят прежние роль и is_active
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TTL = 300
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
+# условные GET справочников: браузерному клиенту нужно видеть ETag и отправлять If-None-Match
+CORS_ALLOW_HEADERS = list(default_headers) + ['if-none-match']
+CORS_EXPOSE_HEADERS = ['ETag']
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# запас в секундах при дельта-синхронизации визитов (GET /api/visits?since=...): покрывает транзакции,
+# которые начались до выдачи курсора, а завершились после
+VISITS_SYNC_OVERLAP = 5
+
+# сколько ошибок валидации JSON Schema собирать по массивам из 1С и МПР, прежде чем прекратить проверку
+# (0 - собирать все)
+SCHEMA_MAX_ERRORS = 20
+
+# обработка фотографий визитов (api.imaging): потоков в пуле, максимальные размеры вариантов
+# (ширина, высота) - по одному полю Photo на вариант - и качество JPEG
+PHOTO_WORKERS = 2
+PHOTO_VARIANTS = {
+    'thumbnail': (320, 320),
+    'web': (1600, 1600),
+}
+PHOTO_JPEG_QUALITY = 85
+# сколько секунд клиент может держать фотографию в кэше без повторной проверки
+PHOTO_CACHE_MAX_AGE = 30 * 24 * 3600
+# внутренний location nginx, указывающий на MEDIA_ROOT (например '/protected-media/'): если задан, файлы
+# отдает nginx по заголовку X-Accel-Redirect, а не Django
+PHOTO_ACCEL_REDIRECT = None
+# наибольший размер фотографии при загрузке частями (POST /api/photos/<визит>/uploads), байт
+PHOTO_UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+
+# SHA-256 загружаемых файлов считается по ходу приема (api.uploads.HashingUploadHandler)
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+ASGI_APPLICATION = 'mprbackend.asgi.application'
+# сколько запросов одновременно выполняют представления при запуске через ASGI (api.asgi): у каждого
+# свой поток и свое соединение с БД. Прием тела и отправка ответа потоков не занимают
+ASGI_THREADS = 20
+
+# фоновый импорт выгрузок из 1С (PUT ...?async=true, api.jobs): потоков-обработчиков в процессе
+# (0 - задания выполняет только команда runimportjobs) и строк, применяемых одной транзакцией: после каждой
+# пачки растет processed задания. Ошибка в середине оставляет уже примененные пачки - статус partial
+IMPORT_WORKERS = 1
+IMPORT_CHUNK_SIZE = 1000
+
+# метрики запросов (api.metrics, GET /api/metrics): запрос медленнее METRICS_SLOW_REQUEST_MS миллисекунд
+# или с числом SQL-запросов больше METRICS_MAX_QUERIES пишется в лог
+METRICS_SLOW_REQUEST_MS = 1000
+METRICS_MAX_QUERIES = 100
+
+# POST /api/generatedata выполняется в запросе: наибольшие объемы за раз, больше - только командой generatedata.
+# orders и answers - строк на один завершенный визит
+GENERATE_DATA_MAX = {
+    'managers': 1000,
+    'clients': 100000,
+    'products': 10000,
+    'questions': 1000,
+    'visits': 100000,
+    'orders': 20,
+    'answers': 20,
+}